@@ -0,0 +1,114 @@
+"""
+Database write benchmark.
+
+Simulates a telemetry storm of plugin data writes from several threads and
+compares committing every write in the old rollback journal mode (the old
+behaviour) with the write-behind group-commit writer in db_utils, e.g.:
+
+    python benchmarks/db_write_benchmark.py --nodes 500 --writes 20
+"""
+import argparse
+import json
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CONFIG = """matrix: {}
+matrix_rooms: []
+meshtastic: {}
+logging:
+  level: "warning"
+"""
+
+
+def telemetry(node, seq):
+    return {"time": seq, "batteryLevel": 50, "voltage": 3.9, "airUtilTx": 1.5, "node": node}
+
+
+def run_threads(threads, target, nodes, writes):
+    per_thread = [nodes[i::threads] for i in range(threads)]
+    workers = [
+        threading.Thread(target=target, args=(chunk, writes)) for chunk in per_thread
+    ]
+    start_time = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return time.perf_counter() - start_time
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--nodes", type=int, default=500)
+    parser.add_argument("--writes", type=int, default=20, help="writes per node")
+    parser.add_argument("--threads", type=int, default=4)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="mmrelay-db-bench-")
+    with open(os.path.join(workdir, "config.yaml"), "w") as f:
+        f.write(CONFIG)
+    os.chdir(workdir)
+    sys.path.insert(0, ROOT)
+
+    # The relay reads config.yaml from the working directory on import
+    from db_utils import db_writer, get_plugin_node_rows, initialize_database, set_plugin_node_rows
+
+    initialize_database()
+    nodes = [f"!{number:08x}" for number in range(args.nodes)]
+    total = args.nodes * args.writes
+
+    # The baseline gets its own database, as WAL mode persists in the file
+    with sqlite3.connect("baseline.sqlite") as conn:
+        conn.execute("PRAGMA journal_mode=DELETE")
+        conn.execute(
+            "CREATE TABLE plugin_data (plugin_name TEXT, meshtastic_id TEXT, data TEXT, PRIMARY KEY (plugin_name, meshtastic_id))"
+        )
+
+    def commit_each(chunk, writes):
+        for seq in range(writes):
+            for node in chunk:
+                with sqlite3.connect("baseline.sqlite", timeout=30) as conn:
+                    data = json.dumps([telemetry(node, seq)])
+                    conn.execute(
+                        "INSERT OR REPLACE INTO plugin_data (plugin_name, meshtastic_id, data) VALUES (?, ?, ?)",
+                        ("direct", node, data),
+                    )
+                    conn.commit()
+
+    def write_behind(chunk, writes):
+        for seq in range(writes):
+            for node in chunk:
+                set_plugin_node_rows("writer", node, [telemetry(node, seq)])
+
+    direct = run_threads(args.threads, commit_each, nodes, args.writes)
+    print(f"Commit per write:   {total} writes in {direct:.2f}s ({total / direct:.0f}/s)")
+
+    start_time = time.perf_counter()
+    queued = run_threads(args.threads, write_behind, nodes, args.writes)
+    db_writer.flush(timeout=None)
+    committed = time.perf_counter() - start_time
+    print(
+        f"Group commit:       {total} writes in {committed:.2f}s ({total / committed:.0f}/s), "
+        f"callers blocked for {queued:.2f}s"
+    )
+
+    start_time = time.perf_counter()
+    for seq in range(args.writes):
+        set_plugin_node_rows("writer", nodes[0], [telemetry(nodes[0], seq)])
+    db_writer.flush(timeout=None)
+    drained = time.perf_counter() - start_time
+    assert get_plugin_node_rows("writer", nodes[0])[0]["time"] == args.writes - 1
+    print(
+        f"Transactions:       {db_writer.writes} writes committed in {db_writer.batches}"
+    )
+    print(f"Read-your-writes flush after {args.writes} writes: {drained * 1000:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
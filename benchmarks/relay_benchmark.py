@@ -0,0 +1,371 @@
+"""
+End-to-end relay benchmark.
+
+Drives the relay's radio and Matrix entry points (`on_meshtastic_message` and
+`on_room_message`) with a fake meshtastic interface and a local stub Matrix
+homeserver, then reports throughput, relay latency, CPU and memory use.
+Runs fully offline, e.g.:
+
+    python benchmarks/relay_benchmark.py --scenario telemetry-storm
+"""
+import argparse
+import asyncio
+import os
+import random
+import resource
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+from aiohttp import web
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+ROOM_ID = "!bench:localhost"
+BOT_USER_ID = "@bench-bot:localhost"
+
+SCENARIOS = {
+    "telemetry-storm": {
+        "nodes": 500,
+        "rate": 50,
+        "mix": {"TELEMETRY_APP": 0.6, "POSITION_APP": 0.3, "TEXT_MESSAGE_APP": 0.1},
+        "chat_burst": 20,
+        "burst_interval": 5,
+    },
+    "chat": {
+        "nodes": 50,
+        "rate": 5,
+        "mix": {"TEXT_MESSAGE_APP": 1.0},
+        "chat_burst": 50,
+        "burst_interval": 2,
+    },
+}
+
+CONFIG_TEMPLATE = """matrix:
+  homeserver: "http://127.0.0.1:{port}"
+  access_token: "benchmark"
+  bot_user_id: "{bot_user_id}"
+
+matrix_rooms:
+  - id: "{room_id}"
+    meshtastic_channel: 0
+
+meshtastic:
+  connection_type: network
+  host: "localhost"
+  meshnet_name: "Benchmark"
+  broadcast_enabled: true
+
+logging:
+  level: "warning"
+
+plugins:
+{plugins}
+"""
+
+
+def percentile(samples, percent):
+    if not samples:
+        return float("nan")
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(percent / 100 * (len(ordered) - 1))))]
+
+
+class StubHomeserver:
+    """Answers the few client-server API calls the relay makes and records sends."""
+
+    def __init__(self):
+        self.received = {}
+        self.send_count = 0
+        self.runner = None
+        self.port = None
+
+    async def handle(self, request):
+        path = request.path
+        if "/send/" in path:
+            content = await request.json()
+            self.send_count += 1
+            marker = content.get("body", "").rsplit(" ", 1)[-1]
+            self.received[marker] = time.perf_counter()
+            return web.json_response({"event_id": f"$bench{self.send_count}"})
+        if path.endswith("/displayname"):
+            return web.json_response({"displayname": "Bench"})
+        if "/join" in path:
+            return web.json_response({"room_id": ROOM_ID})
+        if path.endswith("/filter"):
+            return web.json_response({"filter_id": "bench"})
+        return web.json_response({})
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_route("*", "/{tail:.*}", self.handle)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, "127.0.0.1", 0)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        await self.runner.cleanup()
+
+
+class FakeInterface:
+    """Stands in for a meshtastic interface, recording what the relay transmits."""
+
+    class MyInfo:
+        my_node_num = 1
+
+    def __init__(self, nodes):
+        self.nodes = nodes
+        self.myInfo = self.MyInfo()
+        self.sent = {}
+        self.packet_id = 0
+
+    def getMyNodeInfo(self):
+        return {"num": 1, "user": {"id": "!00000001", "shortName": "BNCH", "hwModel": "BENCH"}}
+
+    def sendText(self, text, destinationId="^all", channelIndex=0, **kwargs):
+        self.sent[text.rsplit(" ", 1)[-1]] = time.perf_counter()
+        return {"text": text}
+
+    def _sendPacket(self, meshPacket, destinationId="^all"):
+        return meshPacket
+
+    def _generatePacketId(self):
+        self.packet_id += 1
+        return self.packet_id
+
+    def sendHeartbeat(self):
+        pass
+
+    def close(self):
+        pass
+
+
+def make_nodes(count):
+    nodes = {}
+    for number in range(2, count + 2):
+        node_id = f"!{number:08x}"
+        nodes[node_id] = {
+            "num": number,
+            "user": {
+                "id": node_id,
+                "longName": f"Node {number}",
+                "shortName": f"N{number % 1000}",
+                "hwModel": "TBEAM",
+            },
+            "position": {
+                "latitude": 52 + random.random(),
+                "longitude": 21 + random.random(),
+            },
+        }
+    return nodes
+
+
+def make_packet(node, portnum, packet_id):
+    packet = {
+        "from": node["num"],
+        "fromId": node["user"]["id"],
+        "to": 0xFFFFFFFF,
+        "toId": "^all",
+        "id": packet_id,
+        "rxTime": int(time.time()),
+        "channel": 0,
+        "decoded": {"portnum": portnum, "payload": b"\x00" * 16},
+    }
+    if portnum == "TEXT_MESSAGE_APP":
+        packet["decoded"]["text"] = f"benchmark message m{packet_id}"
+    elif portnum == "TELEMETRY_APP":
+        packet["decoded"]["telemetry"] = {
+            "time": int(time.time()),
+            "deviceMetrics": {
+                "batteryLevel": random.randint(0, 100),
+                "voltage": round(random.uniform(3.3, 4.2), 2),
+                "airUtilTx": random.random() * 5,
+            },
+        }
+    elif portnum == "POSITION_APP":
+        packet["decoded"]["position"] = dict(node["position"])
+    return packet
+
+
+class RoomEvent:
+    def __init__(self, body, marker):
+        self.body = body
+        self.sender = "@bench-user:localhost"
+        self.event_id = f"$event-{marker}"
+        self.server_timestamp = int(time.time() * 1000)
+        self.source = {"content": {"msgtype": "m.text", "body": body}}
+
+
+class Room:
+    room_id = ROOM_ID
+
+
+def feed_radio_packets(args, nodes, interface, on_meshtastic_message, injected, fed, stop):
+    """
+    Emulates the meshtastic receive thread publishing packets.
+
+    The number of packets published and the seconds spent are stored in `fed`.
+    """
+    portnums = list(args.mix.keys())
+    weights = list(args.mix.values())
+    node_list = list(nodes.values())
+    packet_id = 1000
+    interval = 1 / args.rate
+    start = next_send = time.perf_counter()
+    while not stop.is_set():
+        packet_id += 1
+        portnum = random.choices(portnums, weights)[0]
+        packet = make_packet(random.choice(node_list), portnum, packet_id)
+        if portnum == "TEXT_MESSAGE_APP":
+            injected[f"m{packet_id}"] = time.perf_counter()
+        on_meshtastic_message(packet, interface)
+        fed["packets"] += 1
+        next_send += interval
+        time.sleep(max(0, next_send - time.perf_counter()))
+    fed["seconds"] = time.perf_counter() - start
+
+
+async def send_chat_bursts(args, on_room_message, injected, stop):
+    counter = 0
+    while not stop.is_set():
+        for _ in range(args.chat_burst):
+            counter += 1
+            marker = f"c{counter}"
+            injected[marker] = time.perf_counter()
+            await on_room_message(Room(), RoomEvent(f"hello from matrix {marker}", marker))
+        await asyncio.sleep(args.burst_interval)
+
+
+async def run(args):
+    homeserver = StubHomeserver()
+    await homeserver.start()
+
+    workdir = tempfile.mkdtemp(prefix="mmrelay-bench-")
+    plugins = "".join(
+        f"  {name}:\n    active: true\n" for name in args.plugins if name
+    ) or "  {}\n"
+    with open(os.path.join(workdir, "config.yaml"), "w") as f:
+        f.write(
+            CONFIG_TEMPLATE.format(
+                port=homeserver.port,
+                bot_user_id=BOT_USER_ID,
+                room_id=ROOM_ID,
+                plugins=plugins,
+            )
+        )
+    os.chdir(workdir)
+    sys.path.insert(0, ROOT)
+
+    # The relay reads config.yaml from the working directory on import
+    from db_utils import initialize_database
+    from matrix_utils import connect_matrix, on_room_message
+    from meshtastic_utils import on_meshtastic_message, radios, start_radios
+    from plugin_loader import load_plugins
+
+    initialize_database()
+    load_plugins()
+    await connect_matrix()
+
+    nodes = make_nodes(args.nodes)
+    interface = FakeInterface(nodes)
+    radio = next(iter(radios.values()))
+    radio.client = interface
+    start_radios()
+
+    mesh_injected = {}
+    matrix_injected = {}
+    fed = {"packets": 0, "seconds": 0}
+    stop = threading.Event()
+    feeder = threading.Thread(
+        target=feed_radio_packets,
+        args=(args, nodes, interface, on_meshtastic_message, mesh_injected, fed, stop),
+        daemon=True,
+    )
+
+    cpu_start = time.process_time()
+    wall_start = time.perf_counter()
+    feeder.start()
+    chat_task = asyncio.create_task(
+        send_chat_bursts(args, on_room_message, matrix_injected, stop)
+    )
+    await asyncio.sleep(args.duration)
+    stop.set()
+    feeder.join()
+    # Let the ingestion queue drain
+    while radio.queue.qsize():
+        await asyncio.sleep(0.1)
+    await asyncio.sleep(1)
+    chat_task.cancel()
+
+    wall = time.perf_counter() - wall_start
+    cpu = time.process_time() - cpu_start
+    rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+    mesh_latencies = [
+        homeserver.received[marker] - sent
+        for marker, sent in mesh_injected.items()
+        if marker in homeserver.received
+    ]
+    matrix_latencies = [
+        interface.sent[marker] - sent
+        for marker, sent in matrix_injected.items()
+        if marker in interface.sent
+    ]
+
+    print(f"Scenario: {args.scenario or 'custom'} ({args.nodes} nodes, {args.rate} pkt/s, {args.duration}s)")
+    print(f"Radio packets fed:         {fed['packets']} ({fed['packets'] / fed['seconds']:.1f}/s)")
+    print(f"Mesh -> Matrix relayed:    {len(mesh_latencies)}/{len(mesh_injected)}")
+    print(f"  latency p50 / p99:       {percentile(mesh_latencies, 50) * 1000:.1f} / {percentile(mesh_latencies, 99) * 1000:.1f} ms")
+    print(f"Matrix -> mesh relayed:    {len(matrix_latencies)}/{len(matrix_injected)}")
+    print(f"  latency p50 / p99:       {percentile(matrix_latencies, 50) * 1000:.1f} / {percentile(matrix_latencies, 99) * 1000:.1f} ms")
+    print(f"CPU:                       {cpu:.2f}s ({cpu / wall * 100:.0f}% of one core)")
+    print(f"Max RSS:                   {rss_mb:.1f} MB")
+    if mesh_latencies:
+        print(f"Mean mesh -> Matrix:       {statistics.mean(mesh_latencies) * 1000:.1f} ms")
+
+    await homeserver.stop()
+
+
+def parse_mix(value):
+    mix = {}
+    for part in value.split(","):
+        portnum, weight = part.split("=")
+        mix[portnum.strip()] = float(weight)
+    return mix
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--scenario", choices=sorted(SCENARIOS))
+    parser.add_argument("--nodes", type=int, default=100)
+    parser.add_argument("--rate", type=float, default=20, help="radio packets per second")
+    parser.add_argument(
+        "--mix",
+        type=parse_mix,
+        default={"TELEMETRY_APP": 0.5, "POSITION_APP": 0.3, "TEXT_MESSAGE_APP": 0.2},
+        help="portnum weights, e.g. TELEMETRY_APP=0.6,TEXT_MESSAGE_APP=0.4",
+    )
+    parser.add_argument("--chat-burst", type=int, default=10, help="Matrix messages per burst")
+    parser.add_argument("--burst-interval", type=float, default=5, help="seconds between bursts")
+    parser.add_argument("--duration", type=float, default=30, help="seconds to generate load")
+    parser.add_argument(
+        "--plugins",
+        type=lambda value: value.split(","),
+        default=["telemetry"],
+        help="comma separated plugins to activate",
+    )
+    args = parser.parse_args()
+
+    if args.scenario:
+        for key, value in SCENARIOS[args.scenario].items():
+            setattr(args, key, value)
+
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,30 @@
 import yaml
 from yaml.loader import SafeLoader
 
-relay_config = {}
-with open("config.yaml", "r") as f:
-    relay_config = yaml.load(f, Loader=SafeLoader)
+config_path = "config.yaml"
+
+
+def load_config(path=config_path):
+    with open(path, "r") as f:
+        return yaml.load(f, Loader=SafeLoader)
+
+
+relay_config = load_config()
+
+
+def reload_config():
+    """
+    Read config.yaml again and update `relay_config` in place.
+
+    Modules keep references to `relay_config` and to its `matrix_rooms` list, so
+    both are updated rather than replaced. Raises if the file cannot be parsed,
+    leaving the current config untouched.
+    """
+    new_config = load_config()
+    matrix_rooms = relay_config.get("matrix_rooms")
+    relay_config.clear()
+    relay_config.update(new_config)
+    if matrix_rooms is not None:
+        matrix_rooms[:] = new_config.get("matrix_rooms") or []
+        relay_config["matrix_rooms"] = matrix_rooms
+    return relay_config
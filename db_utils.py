@@ -1,11 +1,240 @@
+import atexit
 import json
+import queue
 import sqlite3
+import threading
+import time
+from config import relay_config
+from metrics_utils import db_operation_duration, timed_db_operation
+from log_utils import get_logger
+
+logger = get_logger(name="DB")
+
+database_path = "meshtastic.sqlite"
+
+
+class DBWriter:
+    """
+    Write-behind writer owning the only writing connection to the database.
+
+    Statements are queued by any thread and executed in order on a single writer
+    thread, which commits them in groups every `interval` seconds or `max_batch`
+    writes, so a burst of writes costs one fsync instead of one each. The
+    statements of one write are applied together or not at all.
+    Readers that must see their own writes call `flush()` first, and pending
+    writes are flushed on shutdown.
+    """
+
+    def __init__(self, path, interval=0.05, max_batch=500):
+        self.path = path
+        self.interval = interval
+        self.max_batch = max_batch
+        self.queue = queue.Queue()
+        self.pending = 0
+        self.batches = 0
+        self.writes = 0
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name="db-writer", daemon=True
+                )
+                self._thread.start()
+                atexit.register(self.close)
+
+    def execute(self, sql, params=()):
+        self.write([(sql, params)])
+
+    def executemany(self, sql, rows):
+        self.write([(sql, rows, True)])
+
+    def write(self, statements):
+        """
+        Queue statements to be committed together.
+
+        :param statements: A list of (sql, params) or (sql, rows, True) for executemany.
+        """
+        self.start()
+        with self._lock:
+            self.pending += 1
+        self.queue.put(statements)
+
+    def flush(self, timeout=5):
+        """
+        Wait until all statements queued so far are committed.
+
+        :param timeout: Most seconds to wait, or None to wait as long as the writer runs.
+        :return: False if the writes were not committed in time or the writer has died.
+        """
+        thread = self._thread
+        if not self.pending or thread is None:
+            return True
+        if threading.current_thread() is thread:
+            return True
+        committed = threading.Event()
+        self.queue.put(committed)
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while not committed.wait(0.1):
+            if not thread.is_alive():
+                logger.error("The database writer has stopped, pending writes are lost")
+                return False
+            if deadline is not None and time.monotonic() >= deadline:
+                logger.warning(f"Database writes not committed after {timeout} secs")
+                return False
+        return True
+
+    def close(self):
+        if self._thread is None:
+            return
+        self.flush(timeout=30)
+        self.queue.put(None)
+        self._thread.join()
+        self._thread = None
+
+    def _run(self):
+        # Transactions are managed explicitly, see _commit
+        conn = sqlite3.connect(self.path, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        stopping = False
+        while not stopping:
+            batch = [self.queue.get()]
+            deadline = time.monotonic() + self.interval
+            # Gather statements until the interval passes, the batch is full or
+            # a reader is waiting for the commit
+            while isinstance(batch[-1], list) and len(batch) < self.max_batch:
+                try:
+                    batch.append(self.queue.get(timeout=max(0, deadline - time.monotonic())))
+                except queue.Empty:
+                    break
+
+            writes = [item for item in batch if isinstance(item, list)]
+            stopping = None in batch
+            if writes:
+                self._commit(conn, writes)
+            for item in batch:
+                if isinstance(item, threading.Event):
+                    item.set()
+        conn.close()
+
+    def _commit(self, conn, writes):
+        with db_operation_duration.labels("group_commit").time():
+            cursor = conn.cursor()
+            cursor.execute("BEGIN")
+            for statements in writes:
+                # A failing statement rolls back the whole write, not the batch
+                cursor.execute("SAVEPOINT write")
+                try:
+                    for sql, params, *many in statements:
+                        if many:
+                            cursor.executemany(sql, params)
+                        else:
+                            cursor.execute(sql, params)
+                except Exception as e:
+                    logger.error(f"Error writing to the database, write rolled back: {e}")
+                    cursor.execute("ROLLBACK TO write")
+                cursor.execute("RELEASE write")
+            try:
+                cursor.execute("COMMIT")
+            except Exception as e:
+                logger.error(f"Error committing {len(writes)} writes: {e}")
+                if conn.in_transaction:
+                    cursor.execute("ROLLBACK")
+        with self._lock:
+            self.pending -= len(writes)
+        self.batches += 1
+        self.writes += len(writes)
+
+
+database_config = relay_config.get("database") or {}
+db_writer = DBWriter(
+    database_path,
+    interval=database_config.get("write_interval_ms", 50) / 1000,
+    max_batch=database_config.get("write_batch_size", 500),
+)
+
+
+def read_connection(flush=False):
+    """
+    Open a connection for reading. Readers see the last committed state of the
+    WAL without waiting for the writer thread.
+
+    :param flush: Wait a bounded time for the pending writes first, for readers
+        that must see their own writes.
+    """
+    if flush:
+        db_writer.flush()
+    return sqlite3.connect(database_path)
+
+
+def migrate_plugin_data_rows(cursor):
+    """
+    Move the JSON lists stored per plugin and node into one row per item.
+
+    Migrated entries are deleted from plugin_data, so this runs on every start
+    and picks up anything left there. Rows already stored for a node keep
+    their place after the migrated ones.
+    """
+    cursor.execute("SELECT plugin_name, meshtastic_id, data FROM plugin_data")
+    migrated = 0
+    for plugin_name, meshtastic_id, data in cursor.fetchall():
+        rows = json.loads(data)
+        if not isinstance(rows, list):
+            rows = [rows]
+        cursor.execute(
+            "SELECT MIN(seq) FROM plugin_node_rows WHERE plugin_name=? AND meshtastic_id=?",
+            (plugin_name, meshtastic_id),
+        )
+        first_seq = cursor.fetchone()[0]
+        start = 1 if first_seq is None else first_seq - len(rows)
+        cursor.executemany(
+            "INSERT INTO plugin_node_rows (plugin_name, meshtastic_id, seq, data) VALUES (?, ?, ?, ?)",
+            [
+                (plugin_name, meshtastic_id, seq, json.dumps(row))
+                for seq, row in enumerate(rows, start=start)
+            ],
+        )
+        cursor.execute(
+            "DELETE FROM plugin_data WHERE plugin_name=? AND meshtastic_id=?",
+            (plugin_name, meshtastic_id),
+        )
+        migrated += 1
+    if migrated:
+        logger.info(f"Migrated plugin data of {migrated} nodes to plugin_node_rows")
+
+
+# Telemetry plugin metrics, and the resolutions in seconds they are rolled up at
+telemetry_metrics = ("batteryLevel", "voltage", "airUtilTx")
+telemetry_resolutions = {"5m": 300, "hourly": 3600, "daily": 86400}
+
+
+def backfill_telemetry_rollups(cursor, plugin_name="telemetry"):
+    """Roll up the raw telemetry samples stored before the rollups table existed."""
+    for resolution in telemetry_resolutions.values():
+        for metric in telemetry_metrics:
+            cursor.execute(
+                "INSERT INTO telemetry_rollups (resolution, meshtastic_id, metric, bucket, count, sum, min, max) "
+                "SELECT ?, meshtastic_id, ?, bucket, COUNT(*), SUM(value), MIN(value), MAX(value) FROM ("
+                "SELECT meshtastic_id, CAST(json_extract(data, '$.time') AS INTEGER) / ? * ? AS bucket, json_extract(data, ?) AS value "
+                "FROM plugin_node_rows WHERE plugin_name=?"
+                ") WHERE bucket IS NOT NULL AND value IS NOT NULL GROUP BY meshtastic_id, bucket",
+                (resolution, metric, resolution, resolution, f"$.{metric}", plugin_name),
+            )
+    cursor.execute("SELECT COUNT(*) FROM telemetry_rollups")
+    backfilled = cursor.fetchone()[0]
+    if backfilled:
+        logger.info(f"Backfilled {backfilled} telemetry rollups from stored samples")
 
 
 # Initialize SQLite database
 def initialize_database():
-    with sqlite3.connect("meshtastic.sqlite") as conn:
+    with sqlite3.connect(database_path) as conn:
         cursor = conn.cursor()
+        # Let readers work alongside the writer thread
+        cursor.execute("PRAGMA journal_mode=WAL")
         cursor.execute(
             "CREATE TABLE IF NOT EXISTS longnames (meshtastic_id TEXT PRIMARY KEY, longname TEXT)"
         )
@@ -15,58 +244,189 @@ def initialize_database():
         cursor.execute(
             "CREATE TABLE IF NOT EXISTS plugin_data (plugin_name TEXT, meshtastic_id TEXT, data TEXT, PRIMARY KEY (plugin_name, meshtastic_id))"
         )
+        cursor.execute(
+            "CREATE TABLE IF NOT EXISTS plugin_node_rows (plugin_name TEXT, meshtastic_id TEXT, seq INTEGER, data TEXT, PRIMARY KEY (plugin_name, meshtastic_id, seq))"
+        )
+        # plugin_data is only read to migrate data stored by older versions
+        migrate_plugin_data_rows(cursor)
+        cursor.execute(
+            "SELECT name FROM sqlite_master WHERE type='table' AND name='telemetry_rollups'"
+        )
+        backfill_rollups = cursor.fetchone() is None
+        cursor.execute(
+            "CREATE TABLE IF NOT EXISTS telemetry_rollups (resolution INTEGER, meshtastic_id TEXT, metric TEXT, bucket INTEGER, count INTEGER, sum REAL, min REAL, max REAL, PRIMARY KEY (resolution, meshtastic_id, metric, bucket))"
+        )
+        if backfill_rollups:
+            backfill_telemetry_rollups(cursor)
+        cursor.execute(
+            "CREATE TABLE IF NOT EXISTS message_history (id INTEGER PRIMARY KEY AUTOINCREMENT, timestamp REAL, direction TEXT, meshtastic_id TEXT, sender TEXT, room_id TEXT, channel INTEGER, text TEXT)"
+        )
+        cursor.execute(
+            "CREATE INDEX IF NOT EXISTS message_history_timestamp ON message_history (timestamp)"
+        )
+        cursor.execute(
+            "CREATE INDEX IF NOT EXISTS message_history_node ON message_history (meshtastic_id, timestamp)"
+        )
+        cursor.execute(
+            "CREATE INDEX IF NOT EXISTS message_history_sender ON message_history (sender, timestamp)"
+        )
+        # Full-text index over the history, kept in sync by triggers
+        cursor.execute(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS message_history_fts USING fts5(sender, text, content='message_history', content_rowid='id')"
+        )
+        cursor.execute(
+            "CREATE TRIGGER IF NOT EXISTS message_history_insert AFTER INSERT ON message_history BEGIN "
+            "INSERT INTO message_history_fts (rowid, sender, text) VALUES (new.id, new.sender, new.text); END"
+        )
+        cursor.execute(
+            "CREATE TRIGGER IF NOT EXISTS message_history_delete AFTER DELETE ON message_history BEGIN "
+            "INSERT INTO message_history_fts (message_history_fts, rowid, sender, text) VALUES ('delete', old.id, old.sender, old.text); END"
+        )
+        cursor.execute(
+            "CREATE TABLE IF NOT EXISTS matrix_state (key TEXT PRIMARY KEY, value TEXT)"
+        )
+        cursor.execute(
+            "CREATE TABLE IF NOT EXISTS node_snapshot (interface TEXT, meshtastic_id TEXT, data TEXT, PRIMARY KEY (interface, meshtastic_id))"
+        )
+        cursor.execute(
+            "CREATE TABLE IF NOT EXISTS outbound_queue (id INTEGER PRIMARY KEY AUTOINCREMENT, interface TEXT, channel INTEGER, text TEXT, expires REAL, history TEXT)"
+        )
+        cursor.execute("PRAGMA table_info(outbound_queue)")
+        if "history" not in [column[1] for column in cursor.fetchall()]:
+            cursor.execute("ALTER TABLE outbound_queue ADD COLUMN history TEXT")
         conn.commit()
+    db_writer.start()
 
 
-def store_plugin_data(plugin_name, meshtastic_id, data):
-    with sqlite3.connect("meshtastic.sqlite") as conn:
-        cursor = conn.cursor()
-        cursor.execute(
-            "INSERT OR REPLACE INTO plugin_data (plugin_name, meshtastic_id, data) VALUES (?, ?, ?) ON CONFLICT (plugin_name, meshtastic_id) DO UPDATE SET data = ?",
-            (plugin_name, meshtastic_id, json.dumps(data), json.dumps(data)),
+# Append data rows for a node, keeping only the newest max_rows.
+# Sequence numbers are assigned by the writer thread, so concurrent appends never
+# overwrite each other.
+@timed_db_operation
+def append_plugin_node_rows(plugin_name, meshtastic_id, rows, max_rows):
+    statements = [
+        (
+            "INSERT INTO plugin_node_rows (plugin_name, meshtastic_id, seq, data) VALUES (?, ?, (SELECT COALESCE(MAX(seq), 0) + 1 FROM plugin_node_rows WHERE plugin_name=? AND meshtastic_id=?), ?)",
+            (plugin_name, meshtastic_id, plugin_name, meshtastic_id, json.dumps(row)),
         )
-        conn.commit()
+        for row in rows
+    ]
+    statements.append(
+        (
+            "DELETE FROM plugin_node_rows WHERE plugin_name=? AND meshtastic_id=? AND seq <= (SELECT MAX(seq) FROM plugin_node_rows WHERE plugin_name=? AND meshtastic_id=?) - ?",
+            (plugin_name, meshtastic_id, plugin_name, meshtastic_id, max_rows),
+        )
+    )
+    db_writer.write(statements)
+
+
+# Replace all data rows of a node
+@timed_db_operation
+def set_plugin_node_rows(plugin_name, meshtastic_id, rows):
+    db_writer.write(
+        [
+            (
+                "DELETE FROM plugin_node_rows WHERE plugin_name=? AND meshtastic_id=?",
+                (plugin_name, meshtastic_id),
+            ),
+            (
+                "INSERT INTO plugin_node_rows (plugin_name, meshtastic_id, seq, data) VALUES (?, ?, ?, ?)",
+                [
+                    (plugin_name, meshtastic_id, seq, json.dumps(row))
+                    for seq, row in enumerate(rows, start=1)
+                ],
+                True,
+            ),
+        ]
+    )
+
 
+@timed_db_operation
+def delete_plugin_node_rows(plugin_name, meshtastic_id):
+    db_writer.execute(
+        "DELETE FROM plugin_node_rows WHERE plugin_name=? AND meshtastic_id=?",
+        (plugin_name, meshtastic_id),
+    )
 
-def delete_plugin_data(plugin_name, meshtastic_id):
-    with sqlite3.connect("meshtastic.sqlite") as conn:
+
+@timed_db_operation
+def get_plugin_node_rows(plugin_name, meshtastic_id):
+    # Plugins update node data read-modify-write, so see the last write first
+    with read_connection(flush=True) as conn:
         cursor = conn.cursor()
         cursor.execute(
-            "DELETE FROM plugin_data WHERE plugin_name=? AND meshtastic_id=?",
+            "SELECT data FROM plugin_node_rows WHERE plugin_name=? AND meshtastic_id=? ORDER BY seq",
             (plugin_name, meshtastic_id),
         )
-        conn.commit()
+        return [json.loads(data) for (data,) in cursor.fetchall()]
 
 
-# Get the data for a given plugin and Meshtastic ID
-def get_plugin_data_for_node(plugin_name, meshtastic_id):
-    with sqlite3.connect("meshtastic.sqlite") as conn:
+# Get the data rows of all nodes for a given plugin, by Meshtastic ID
+@timed_db_operation
+def get_plugin_rows(plugin_name):
+    with read_connection() as conn:
         cursor = conn.cursor()
         cursor.execute(
-            "SELECT data FROM plugin_data WHERE plugin_name=? AND meshtastic_id=?",
-            (
-                plugin_name,
-                meshtastic_id,
-            ),
+            "SELECT meshtastic_id, data FROM plugin_node_rows WHERE plugin_name=? ORDER BY meshtastic_id, seq",
+            (plugin_name,),
         )
-        result = cursor.fetchone()
-    return json.loads(result[0] if result else "[]")
+        nodes = {}
+        for meshtastic_id, data in cursor.fetchall():
+            nodes.setdefault(meshtastic_id, []).append(json.loads(data))
+        return nodes
+
 
+# Add a telemetry sample to the aggregates of each resolution (in seconds)
+@timed_db_operation
+def record_telemetry_rollups(meshtastic_id, sample_time, metrics, resolutions):
+    rows = [
+        (resolution, meshtastic_id, metric, int(sample_time // resolution) * resolution, value, value, value)
+        for resolution in resolutions
+        for metric, value in metrics.items()
+    ]
+    db_writer.executemany(
+        "INSERT INTO telemetry_rollups (resolution, meshtastic_id, metric, bucket, count, sum, min, max) VALUES (?, ?, ?, ?, 1, ?, ?, ?) "
+        "ON CONFLICT (resolution, meshtastic_id, metric, bucket) DO UPDATE SET count = count + 1, sum = sum + excluded.sum, min = MIN(min, excluded.min), max = MAX(max, excluded.max)",
+        rows,
+    )
 
-# Get the data for a given plugin
-def get_plugin_data(plugin_name):
-    with sqlite3.connect("meshtastic.sqlite") as conn:
+
+# Get (bucket, count, sum, min, max) of a metric for one node or the whole mesh
+@timed_db_operation
+def get_telemetry_rollups(resolution, metric, start, end, meshtastic_id=None):
+    query = "SELECT bucket, SUM(count), SUM(sum), MIN(min), MAX(max) FROM telemetry_rollups WHERE resolution=? AND metric=? AND bucket >= ? AND bucket < ?"
+    params = [resolution, metric, int(start // resolution) * resolution, end]
+    if meshtastic_id:
+        query += " AND meshtastic_id=?"
+        params.append(meshtastic_id)
+    with read_connection() as conn:
         cursor = conn.cursor()
-        cursor.execute(
-            "SELECT data FROM plugin_data WHERE plugin_name=? ",
-            (plugin_name,),
-        )
+        cursor.execute(query + " GROUP BY bucket ORDER BY bucket", params)
         return cursor.fetchall()
 
 
+# Expire raw plugin rows and rollups older than their retention, both in seconds
+@timed_db_operation
+def compact_telemetry(plugin_name, raw_retention, rollup_retention, now):
+    statements = [
+        (
+            "DELETE FROM plugin_node_rows WHERE plugin_name=? AND json_extract(data, '$.time') < ?",
+            (plugin_name, now - raw_retention),
+        )
+    ]
+    for resolution, retention in rollup_retention.items():
+        statements.append(
+            (
+                "DELETE FROM telemetry_rollups WHERE resolution=? AND bucket < ?",
+                (resolution, now - retention),
+            )
+        )
+    db_writer.write(statements)
+
+
 # Get the longname for a given Meshtastic ID
+@timed_db_operation
 def get_longname(meshtastic_id):
-    with sqlite3.connect("meshtastic.sqlite") as conn:
+    with read_connection() as conn:
         cursor = conn.cursor()
         cursor.execute(
             "SELECT longname FROM longnames WHERE meshtastic_id=?", (meshtastic_id,)
@@ -75,14 +435,12 @@ def get_longname(meshtastic_id):
     return result[0] if result else None
 
 
+@timed_db_operation
 def save_longname(meshtastic_id, longname):
-    with sqlite3.connect("meshtastic.sqlite") as conn:
-        cursor = conn.cursor()
-        cursor.execute(
-            "INSERT OR REPLACE INTO longnames (meshtastic_id, longname) VALUES (?, ?)",
-            (meshtastic_id, longname),
-        )
-        conn.commit()
+    db_writer.execute(
+        "INSERT OR REPLACE INTO longnames (meshtastic_id, longname) VALUES (?, ?)",
+        (meshtastic_id, longname),
+    )
 
 def update_longnames(nodes):
     if nodes:
@@ -93,22 +451,21 @@ def update_longnames(nodes):
                 longname = user.get("longName", "N/A")
                 save_longname(meshtastic_id, longname)
 
+@timed_db_operation
 def get_shortname(meshtastic_id):
-    with sqlite3.connect("meshtastic.sqlite") as conn:
+    with read_connection() as conn:
         cursor = conn.cursor()
         cursor.execute(
             "SELECT shortname FROM shortnames WHERE meshtastic_id=?", (meshtastic_id,))
         result = cursor.fetchone()
     return result[0] if result else None
 
+@timed_db_operation
 def save_shortname(meshtastic_id, shortname):
-    with sqlite3.connect("meshtastic.sqlite") as conn:
-        cursor = conn.cursor()
-        cursor.execute(
-            "INSERT OR REPLACE INTO shortnames (meshtastic_id, shortname) VALUES (?, ?)",
-            (meshtastic_id, shortname),
-        )
-        conn.commit()
+    db_writer.execute(
+        "INSERT OR REPLACE INTO shortnames (meshtastic_id, shortname) VALUES (?, ?)",
+        (meshtastic_id, shortname),
+    )
 
 def update_shortnames(nodes):
     if nodes:
@@ -117,4 +474,156 @@ def update_shortnames(nodes):
             if user:
                 meshtastic_id = user["id"]
                 shortname = user.get("shortName", "N/A")
-                save_shortname(meshtastic_id, shortname)
\ No newline at end of file
+                save_shortname(meshtastic_id, shortname)
+
+# Get a persisted Matrix client value, e.g. the sync token or a resolved room alias
+@timed_db_operation
+def get_matrix_state(key):
+    with read_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT value FROM matrix_state WHERE key=?", (key,))
+        result = cursor.fetchone()
+    return result[0] if result else None
+
+
+@timed_db_operation
+def save_matrix_state(key, value):
+    db_writer.execute(
+        "INSERT OR REPLACE INTO matrix_state (key, value) VALUES (?, ?)",
+        (key, value),
+    )
+
+
+# Queue a Matrix message for the radio, dropping the oldest ones beyond max_size
+@timed_db_operation
+def enqueue_outbound_message(interface, channel, text, expires, max_size, history=None):
+    db_writer.write(
+        [
+            (
+                "INSERT INTO outbound_queue (interface, channel, text, expires, history) VALUES (?, ?, ?, ?, ?)",
+                (interface, channel, text, expires, json.dumps(history) if history else None),
+            ),
+            (
+                "DELETE FROM outbound_queue WHERE interface=? AND id NOT IN (SELECT id FROM outbound_queue WHERE interface=? ORDER BY id DESC LIMIT ?)",
+                (interface, interface, max_size),
+            ),
+        ]
+    )
+
+
+@timed_db_operation
+def get_outbound_messages(interface, limit=20):
+    # Sent messages are deleted before the next ones are read
+    with read_connection(flush=True) as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            "SELECT id, channel, text, expires, history FROM outbound_queue WHERE interface=? ORDER BY id LIMIT ?",
+            (interface, limit),
+        )
+        return [
+            (message_id, channel, text, expires, json.loads(history) if history else None)
+            for message_id, channel, text, expires, history in cursor.fetchall()
+        ]
+
+
+@timed_db_operation
+def delete_outbound_message(message_id):
+    db_writer.execute("DELETE FROM outbound_queue WHERE id=?", (message_id,))
+
+
+@timed_db_operation
+def count_outbound_messages(interface):
+    with read_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            "SELECT COUNT(*) FROM outbound_queue WHERE interface=?", (interface,)
+        )
+        return cursor.fetchone()[0]
+
+
+# Persist the NodeDB of a radio so it can be served before the radio streams it again.
+# Nodes missing from `nodes` are removed from the stored snapshot.
+@timed_db_operation
+def save_node_snapshot(interface, nodes):
+    db_writer.write(
+        [
+            ("DELETE FROM node_snapshot WHERE interface=?", (interface,)),
+            (
+                "INSERT INTO node_snapshot (interface, meshtastic_id, data) VALUES (?, ?, ?)",
+                [
+                    (interface, meshtastic_id, json.dumps(node))
+                    for meshtastic_id, node in nodes.items()
+                ],
+                True,
+            ),
+        ]
+    )
+
+
+@timed_db_operation
+def get_node_snapshot(interface):
+    with read_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            "SELECT meshtastic_id, data FROM node_snapshot WHERE interface=?",
+            (interface,),
+        )
+        return {meshtastic_id: json.loads(data) for meshtastic_id, data in cursor.fetchall()}
+
+
+# Write the metadata of a node learned from a received packet
+@timed_db_operation
+def save_node_metadata(interface, meshtastic_id, node):
+    db_writer.execute(
+        "INSERT OR REPLACE INTO node_snapshot (interface, meshtastic_id, data) VALUES (?, ?, ?)",
+        (interface, meshtastic_id, json.dumps(node)),
+    )
+    user = node.get("user")
+    if user:
+        save_longname(user["id"], user.get("longName", "N/A"))
+        save_shortname(user["id"], user.get("shortName", "N/A"))
+
+
+# Record a relayed message, direction is "mesh_to_matrix" or "matrix_to_mesh"
+@timed_db_operation
+def save_message_history(direction, sender, text, meshtastic_id=None, room_id=None, channel=None, timestamp=None):
+    db_writer.execute(
+        "INSERT INTO message_history (timestamp, direction, meshtastic_id, sender, room_id, channel, text) VALUES (?, ?, ?, ?, ?, ?, ?)",
+        (timestamp or time.time(), direction, meshtastic_id, sender, room_id, channel, text),
+    )
+
+
+# Get the newest relayed messages as (timestamp, direction, sender, text), optionally of one sender
+@timed_db_operation
+def get_message_history(sender=None, limit=10, offset=0):
+    query = "SELECT timestamp, direction, sender, text FROM message_history"
+    params = []
+    if sender and sender.startswith("!"):
+        query += " WHERE meshtastic_id=?"
+        params.append(sender)
+    elif sender:
+        query += " WHERE sender=?"
+        params.append(sender)
+    with read_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(query + " ORDER BY timestamp DESC LIMIT ? OFFSET ?", params + [limit, offset])
+        return cursor.fetchall()
+
+
+# Search relayed messages containing all of the given words, newest first
+@timed_db_operation
+def search_message_history(terms, limit=10, offset=0):
+    # Quote each word so user input is never parsed as FTS5 query syntax
+    match = " ".join('"' + term.replace('"', '""') + '"' for term in terms.split())
+    with read_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            "SELECT m.timestamp, m.direction, m.sender, m.text FROM message_history_fts f JOIN message_history m ON m.id = f.rowid WHERE message_history_fts MATCH ? ORDER BY m.timestamp DESC LIMIT ? OFFSET ?",
+            (match, limit, offset),
+        )
+        return cursor.fetchall()
+
+
+@timed_db_operation
+def expire_message_history(before):
+    db_writer.execute("DELETE FROM message_history WHERE timestamp < ?", (before,))
@@ -0,0 +1,62 @@
+import threading
+import time
+from collections import OrderedDict
+from config import relay_config
+
+
+class PacketDedupCache:
+    """
+    Time-bounded cache of recently relayed packets keyed on (from, packet id).
+
+    Used in both relay directions so the same radio packet heard by several
+    bridged relays is only relayed once.
+    """
+
+    def __init__(self, ttl=300, max_entries=2000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _expire(self, now):
+        while self._entries:
+            key, expires = next(iter(self._entries.items()))
+            if expires > now:
+                break
+            del self._entries[key]
+
+    def seen(self, sender, packet_id):
+        """
+        Record a packet and report whether it was already recorded.
+
+        :param sender: The numeric or string ID of the originating node.
+        :param packet_id: The Meshtastic packet ID.
+        :return: True if the packet was seen within the TTL, otherwise False.
+            Packet IDs that are not numbers, e.g. from a forged Matrix event,
+            are never seen.
+        """
+        if sender is None or not packet_id:
+            return False
+        try:
+            key = (str(sender), int(packet_id))
+        except (TypeError, ValueError):
+            return False
+
+        now = time.monotonic()
+        with self._lock:
+            self._expire(now)
+            if key in self._entries:
+                return True
+            self._entries[key] = now + self.ttl
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return False
+
+    def __len__(self):
+        return len(self._entries)
+
+
+dedup_cache = PacketDedupCache(
+    ttl=relay_config["meshtastic"].get("dedup_ttl", 300),
+    max_entries=relay_config["meshtastic"].get("dedup_max_entries", 2000),
+)
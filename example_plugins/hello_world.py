@@ -2,7 +2,7 @@ from plugins.base_plugin import BasePlugin
 
 
 class Plugin(BasePlugin):
-    plugin_name = "helloworld"
+    plugin_name = "hello_world"
 
     async def handle_meshtastic_message(
         self, packet, formatted_message, longname, meshnet_name
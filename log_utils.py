@@ -1,6 +1,166 @@
+import atexit
+import json
 import logging
+import logging.handlers
+import queue
+import random
+import threading
+import time
 from config import relay_config
 
+# Records are queued by the calling thread and written by a single listener thread,
+# so log I/O never happens on the radio or Matrix code paths.
+log_queue = queue.Queue(-1)
+log_listener = None
+
+date_format = "%Y-%m-%d %H:%M:%S %z"
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "time": self.formatTime(record, self.datefmt),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry)
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    Limit how often the same log call is emitted.
+
+    Records are keyed on logger name and unformatted message, so one call site
+    logging every packet is a single key. Each key may emit `rate` records per
+    second with bursts up to `burst`; beyond that a `sample_rate` fraction is still
+    emitted and the rest are counted and reported in a periodic summary.
+    Warnings and errors are never limited.
+    """
+
+    max_keys = 1000
+
+    def __init__(self, rate=10, burst=None, summary_interval=60, sample_rate=0.0):
+        super().__init__()
+        self.rate = rate
+        self.burst = burst or rate
+        self.summary_interval = summary_interval
+        self.sample_rate = sample_rate
+        # Ordered from least to most recently used
+        self.buckets = {}
+        self.suppressed = {}
+        self._lock = threading.Lock()
+        # Summaries are due even if the call site never logs again
+        self._summary_thread = threading.Thread(
+            target=self._summary_loop, name="log-summary", daemon=True
+        )
+        self._summary_thread.start()
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING or getattr(record, "rate_limit_summary", False):
+            return True
+
+        key = (record.name, str(record.msg))
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self.buckets.pop(key, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - updated) * self.rate)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            self.buckets[key] = (tokens, now)
+            # Forget the least recently used call sites, e.g. keys from pre-formatted messages
+            while len(self.buckets) > self.max_keys:
+                del self.buckets[next(iter(self.buckets))]
+
+            if not allowed:
+                if random.random() < self.sample_rate:
+                    allowed = True
+                else:
+                    self.suppressed[key] = self.suppressed.get(key, 0) + 1
+        return allowed
+
+    def _summary_loop(self):
+        while True:
+            time.sleep(self.summary_interval)
+            self.flush_summaries()
+
+    def flush_summaries(self):
+        """Log how many records of each call site were suppressed since the last summary."""
+        with self._lock:
+            summaries, self.suppressed = self.suppressed, {}
+        for (name, msg), count in summaries.items():
+            self.emit_summary(name, msg, count)
+
+    def emit_summary(self, name, msg, count):
+        logger = logging.getLogger(name)
+        record = logger.makeRecord(
+            name,
+            logging.INFO,
+            __file__,
+            0,
+            "Suppressed %d messages like: %s",
+            (count, msg),
+            None,
+        )
+        record.rate_limit_summary = True
+        logger.handle(record)
+
+
+rate_limit_filter = None
+
+
+def get_rate_limit_filter():
+    global rate_limit_filter
+    rate_limit_config = relay_config["logging"].get("rate_limit")
+    if rate_limit_config and rate_limit_filter is None:
+        rate_limit_filter = RateLimitFilter(
+            rate=rate_limit_config.get("messages_per_second", 10),
+            burst=rate_limit_config.get("burst"),
+            summary_interval=rate_limit_config.get("summary_interval", 60),
+            sample_rate=rate_limit_config.get("sample_rate", 0.0),
+        )
+    return rate_limit_filter
+
+
+def create_formatter():
+    if relay_config["logging"].get("format") == "json":
+        return JsonFormatter(datefmt=date_format)
+    return logging.Formatter(
+        fmt="%(asctime)s %(levelname)s:%(name)s:%(message)s",
+        datefmt=date_format,
+    )
+
+
+def start_log_listener():
+    global log_listener
+    if log_listener:
+        return log_listener
+
+    formatter = create_formatter()
+    handlers = [logging.StreamHandler()]
+
+    log_file = relay_config["logging"].get("file")
+    if log_file:
+        handlers.append(
+            logging.handlers.RotatingFileHandler(
+                log_file,
+                maxBytes=relay_config["logging"].get("max_bytes", 10 * 1024 * 1024),
+                backupCount=relay_config["logging"].get("backup_count", 5),
+            )
+        )
+
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    log_listener = logging.handlers.QueueListener(log_queue, *handlers)
+    log_listener.start()
+    # Flush queued records on shutdown
+    atexit.register(log_listener.stop)
+    return log_listener
+
 
 def get_logger(name):
     logger = logging.getLogger(name=name)
@@ -9,12 +169,11 @@ def get_logger(name):
     logger.setLevel(log_level)
     logger.propagate = False  # Add this line to prevent double logging
 
-    handler = logging.StreamHandler()
-    handler.setFormatter(
-        logging.Formatter(
-            fmt=f"%(asctime)s %(levelname)s:%(name)s:%(message)s",
-            datefmt="%Y-%m-%d %H:%M:%S %z",
-        )
-    )
-    logger.addHandler(handler)
+    if not logger.handlers:
+        handler = logging.handlers.QueueHandler(log_queue)
+        # Applied before the record is formatted and queued
+        if get_rate_limit_filter():
+            handler.addFilter(rate_limit_filter)
+        logger.addHandler(handler)
+    start_log_listener()
     return logger
@@ -3,84 +3,164 @@ This script connects a Meshtastic mesh network to Matrix chat rooms by relaying
 It uses Meshtastic-python and Matrix nio client library to interface with the radio and the Matrix server respectively.
 """
 import asyncio
+import multiprocessing
+import signal
+import time
 from nio import (
     RoomMessageText,
     RoomMessageNotice,
+    SyncResponse,
 )
 from pubsub import pub
 from typing import List
-from db_utils import initialize_database, update_longnames, update_shortnames
+from db_utils import db_writer, initialize_database
 from matrix_utils import (
     connect_matrix,
     join_matrix_room,
+    get_sync_token,
     on_room_message,
+    on_sync_response,
+    sync_matrix,
     logger as matrix_logger,
 )
 from plugin_loader import load_plugins
+from reload_utils import reload_relay
+from scheduler_utils import scheduler
+from metrics_utils import start_metrics_server
 from config import relay_config
 from log_utils import get_logger
 from meshtastic_utils import (
-    connect_meshtastic,
     on_meshtastic_message,
     on_lost_meshtastic_connection,
+    on_node_metadata,
+    radios,
+    start_radios,
     logger as meshtastic_logger,
 )
 
 logger = get_logger(name="M<>M Relay")
-meshtastic_interface = connect_meshtastic()
 matrix_rooms: List[dict] = relay_config["matrix_rooms"]
 matrix_access_token = relay_config["matrix"]["access_token"]
 
-async def main():
-    # Initialize the SQLite database
-    initialize_database()
 
-    # Load plugins early
-    load_plugins()
+async def timed_phase(phase, coro):
+    """Await a startup step and log how long it took."""
+    start_time = time.perf_counter()
+    try:
+        return await coro
+    finally:
+        logger.info(
+            f"Startup phase '{phase}' took {time.perf_counter() - start_time:.2f}s"
+        )
+
+
+async def connect_radio(radio):
+    # The serial/BLE handshake and NodeDB download block, so run them in a thread
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(None, radio.connect)
 
-    matrix_client = await connect_matrix()
+
+async def start_matrix():
+    """Connect, log in and join all configured rooms, returning the client or None."""
+    matrix_client = await timed_phase("matrix connect", connect_matrix())
 
     matrix_logger.info("Connecting ...")
     try:
-        login_response = await matrix_client.login(matrix_access_token)
+        await timed_phase("matrix login", matrix_client.login(matrix_access_token))
     except Exception as e:
         matrix_logger.error(f"Error connecting to Matrix server: {e}")
-        return
+        return None
+
+    # Join the rooms specified in the config.yaml, resolving aliases concurrently
+    await timed_phase(
+        "matrix room joins",
+        asyncio.gather(
+            *[join_matrix_room(matrix_client, room["id"]) for room in matrix_rooms]
+        ),
+    )
+    return matrix_client
+
+
+# Reloads started by SIGHUP, referenced until done so they are not garbage collected
+reload_tasks = set()
+
+
+def on_sighup():
+    task = asyncio.create_task(reload_relay())
+    reload_tasks.add(task)
+    task.add_done_callback(reload_tasks.discard)
 
-    # Join the rooms specified in the config.yaml
-    for room in matrix_rooms:
-        await join_matrix_room(matrix_client, room["id"])
+
+def on_sigterm(signum, frame):
+    # systemd stops the relay with SIGTERM, which skips the atexit hooks, so
+    # commit the queued database writes before exiting
+    logger.info("Received SIGTERM, shutting down")
+    db_writer.close()
+    raise SystemExit(0)
+
+
+async def main():
+    startup_time = time.perf_counter()
+
+    # Initialize the SQLite database
+    initialize_database()
+    signal.signal(signal.SIGTERM, on_sigterm)
+
+    # Expose relay metrics if enabled
+    await start_metrics_server()
+
+    # Load plugins early
+    load_plugins()
+    scheduler.start()
 
     # Register the Meshtastic message callback
     meshtastic_logger.info(f"Listening for inbound radio messages ...")
     pub.subscribe(
         on_meshtastic_message, "meshtastic.receive", loop=asyncio.get_event_loop()
     )
+    # Keep node names and positions current as NODEINFO/POSITION packets arrive
+    pub.subscribe(on_node_metadata, "meshtastic.receive")
     pub.subscribe(
         on_lost_meshtastic_connection,
         "meshtastic.connection.lost",
     )
+
+    # Connect the radios while logging in to Matrix, so startup takes as long
+    # as the slowest step rather than the sum of them
+    radio_tasks = [
+        asyncio.create_task(timed_phase(f"radio {name} connect", connect_radio(radio)))
+        for name, radio in radios.items()
+    ]
+    matrix_client = await timed_phase("matrix startup", start_matrix())
+    await asyncio.gather(*radio_tasks)
+    if matrix_client is None:
+        return
+
+    # Start ingesting packets and watch each radio link, reconnecting when it drops
+    start_radios()
     # Register the message callback
     matrix_logger.info(f"Listening for inbound matrix messages ...")
     matrix_client.add_event_callback(
         on_room_message, (RoomMessageText, RoomMessageNotice)
     )
+    matrix_client.add_response_callback(on_sync_response, SyncResponse)
 
-    # Start the Matrix client
-    while True:
-        try:
-            if meshtastic_interface:
-                # Update longnames & shortnames
-                update_longnames(meshtastic_interface.nodes)
-                update_shortnames(meshtastic_interface.nodes)
+    # Resume from the last stored sync token to skip the initial sync
+    sync_token = get_sync_token()
+    if sync_token:
+        matrix_logger.info("Resuming sync from stored token")
+        matrix_client.next_batch = sync_token
+    logger.info(f"Startup completed in {time.perf_counter() - startup_time:.2f}s")
 
-            matrix_logger.info("Syncing with server...")
-            await matrix_client.sync_forever(timeout=30000)
-            matrix_logger.info("Sync completed.")
-        except Exception as e:
-            matrix_logger.error(f"Error syncing with server: {e}")
+    # Reload config.yaml and the plugins on SIGHUP, keeping the connections
+    if hasattr(signal, "SIGHUP"):
+        asyncio.get_running_loop().add_signal_handler(signal.SIGHUP, on_sighup)
 
-        await asyncio.sleep(60)  # Update longnames & shortnames every 60 seconds
+    # Start the Matrix client
+    await sync_matrix(matrix_client)
 
 
-asyncio.run(main())
+if __name__ == "__main__":
+    # Plugin worker processes import this module, they must not start a relay
+    multiprocessing.freeze_support()
+    asyncio.run(main())
@@ -11,12 +11,18 @@ from nio import (
     MatrixRoom,
     RoomMessageText,
     RoomMessageNotice,
+    SyncError,
+    SyncResponse,
+    UploadFilterResponse,
     UploadResponse,
 )
 from config import relay_config
+from db_utils import get_matrix_state, save_matrix_state
 from log_utils import get_logger
-from plugin_loader import load_plugins
-from meshtastic_utils import connect_meshtastic
+from plugin_loader import load_plugins, run_plugin_handler
+from metrics_utils import matrix_send_failures
+from meshtastic_utils import current_interface, get_radio, get_room_interface
+from dedup_utils import dedup_cache
 from PIL import Image
 
 matrix_homeserver = relay_config["matrix"]["homeserver"]
@@ -32,6 +38,8 @@ bot_start_time = int(
 logger = get_logger(name="Matrix")
 
 matrix_client = None
+last_sync_token = None
+sync_filter_stale = False
 
 
 def bot_command(command, payload):
@@ -62,13 +70,28 @@ async def join_matrix_room(matrix_client, room_id_or_alias: str) -> None:
     """Join a Matrix room by its ID or alias."""
     try:
         if room_id_or_alias.startswith("#"):
-            response = await matrix_client.room_resolve_alias(room_id_or_alias)
-            if not response.room_id:
-                logger.error(
-                    f"Failed to resolve room alias '{room_id_or_alias}': {response.message}"
+            # Resolved on every start and reload so a re-pointed alias is followed,
+            # the stored room is only used while the homeserver cannot resolve it
+            state_key = f"alias:{room_id_or_alias}"
+            try:
+                response = await matrix_client.room_resolve_alias(room_id_or_alias)
+                room_id = getattr(response, "room_id", None)
+                error = getattr(response, "message", None)
+            except Exception as e:
+                room_id, error = None, e
+            if room_id:
+                if room_id != get_matrix_state(state_key):
+                    save_matrix_state(state_key, room_id)
+            else:
+                room_id = get_matrix_state(state_key)
+                if not room_id:
+                    logger.error(
+                        f"Failed to resolve room alias '{room_id_or_alias}': {error}"
+                    )
+                    return
+                logger.warning(
+                    f"Failed to resolve room alias '{room_id_or_alias}', using last known room {room_id}: {error}"
                 )
-                return
-            room_id = response.room_id
             # Update the room ID in the matrix_rooms list
             for room_config in matrix_rooms:
                 if room_config["id"] == room_id_or_alias:
@@ -92,8 +115,109 @@ async def join_matrix_room(matrix_client, room_id_or_alias: str) -> None:
         logger.error(f"Error joining room '{room_id_or_alias}': {e}")
 
 
+def get_sync_token():
+    """Return the sync token stored by the last run, if any."""
+    return get_matrix_state("next_batch")
+
+
+def build_sync_filter():
+    """
+    Build a sync filter limited to the mapped rooms and the events the relay uses.
+
+    Presence, ephemeral and account data events are never relayed, so they are excluded.
+    """
+    room_ids = [
+        room["id"] for room in matrix_rooms if room["id"].startswith("!")
+    ]
+    return {
+        "presence": {"not_types": ["*"]},
+        "account_data": {"not_types": ["*"]},
+        "room": {
+            "rooms": room_ids,
+            "timeline": {"types": ["m.room.message", "m.room.member"]},
+            "state": {"types": ["m.room.member"], "lazy_load_members": True},
+            "ephemeral": {"not_types": ["*"]},
+            "account_data": {"not_types": ["*"]},
+        },
+    }
+
+
+async def upload_sync_filter(matrix_client):
+    """
+    Upload the sync filter to the homeserver.
+
+    :return: The filter ID, or the filter itself if the upload failed.
+    """
+    sync_filter = build_sync_filter()
+    try:
+        response = await matrix_client.upload_filter(
+            presence=sync_filter["presence"],
+            account_data=sync_filter["account_data"],
+            room=sync_filter["room"],
+        )
+        if isinstance(response, UploadFilterResponse):
+            logger.debug(f"Uploaded sync filter {response.filter_id}")
+            return response.filter_id
+        logger.warning(f"Failed to upload sync filter: {response.message}")
+    except Exception as e:
+        logger.warning(f"Failed to upload sync filter: {e}")
+    return sync_filter
+
+
+async def sync_matrix(matrix_client):
+    """
+    Sync with the homeserver forever, running the event and response callbacks.
+
+    Unlike nio's sync_forever, the sync filter can be replaced between two sync
+    requests (see `update_sync_filter`), so a reload started from a room message
+    callback never has to cancel the sync that is running it.
+    """
+    global sync_filter_stale
+    sync_filter = await upload_sync_filter(matrix_client)
+    timeout = 0  # Return right away on the first sync
+    logger.info("Syncing with server...")
+    while True:
+        if sync_filter_stale:
+            sync_filter_stale = False
+            sync_filter = await upload_sync_filter(matrix_client)
+        try:
+            # Resumes from the client's next_batch token
+            response = await matrix_client.sync(timeout=timeout, sync_filter=sync_filter)
+            await matrix_client.run_response_callbacks([response])
+            if isinstance(response, SyncError):
+                logger.error(f"Error syncing with server: {response.message}")
+                await asyncio.sleep(60)  # Wait before resyncing
+                continue
+            timeout = 30000
+        except Exception as e:
+            logger.error(f"Error syncing with server: {e}")
+            await asyncio.sleep(60)  # Wait before resyncing
+
+
+def update_sync_filter():
+    """Sync with a filter built from the current room list from the next sync request on."""
+    global sync_filter_stale
+    sync_filter_stale = True
+
+
+# Persist the sync token so a restart resumes instead of doing an initial sync
+async def on_sync_response(response: SyncResponse) -> None:
+    global last_sync_token
+    if response.next_batch and response.next_batch != last_sync_token:
+        save_matrix_state("next_batch", response.next_batch)
+        last_sync_token = response.next_batch
+
+
 # Send message to the Matrix room
-async def matrix_relay(room_id, message, longname, shortname, meshnet_name):
+async def matrix_relay(
+    room_id,
+    message,
+    longname,
+    shortname,
+    meshnet_name,
+    meshtastic_from=None,
+    packet_id=None,
+):
     matrix_client = await connect_matrix()
     try:
         content = {
@@ -103,6 +227,10 @@ async def matrix_relay(room_id, message, longname, shortname, meshnet_name):
             "meshtastic_shortname": shortname,
             "meshtastic_meshnet": meshnet_name,
         }
+        # Lets other relays recognise a packet they have already relayed
+        if meshtastic_from is not None and packet_id:
+            content["meshtastic_from"] = meshtastic_from
+            content["meshtastic_packet_id"] = packet_id
         await asyncio.wait_for(
             matrix_client.room_send(
                 room_id=room_id,
@@ -111,12 +239,16 @@ async def matrix_relay(room_id, message, longname, shortname, meshnet_name):
             ),
             timeout=0.5,
         )
-        logger.info(f"Sent inbound radio message to matrix room: {room_id}")
+        logger.info("Sent inbound radio message to matrix room: %s", room_id)
+        return True
 
     except asyncio.TimeoutError:
-        logger.error(f"Timed out while waiting for Matrix response")
+        matrix_send_failures.labels("timeout").inc()
+        logger.error("Timed out while waiting for Matrix response")
     except Exception as e:
-        logger.error(f"Error sending radio message to matrix room {room_id}: {e}")
+        matrix_send_failures.labels("error").inc()
+        logger.error("Error sending radio message to matrix room %s: %s", room_id, e)
+    return False
 
 
 def truncate_message(
@@ -137,6 +269,7 @@ def truncate_message(
 async def on_room_message(
     room: MatrixRoom, event: Union[RoomMessageText, RoomMessageNotice]
 ) -> None:
+    received_at = time.monotonic()
     full_display_name = "Unknown user"
     message_timestamp = event.server_timestamp
 
@@ -166,10 +299,18 @@ async def on_room_message(
     if suppress:
         return
 
+    # Do not send a radio packet back to the mesh if it was already relayed
+    if dedup_cache.seen(
+        event.source["content"].get("meshtastic_from"),
+        event.source["content"].get("meshtastic_packet_id"),
+    ):
+        logger.debug("Skipping duplicate radio packet in event %s", event.event_id)
+        return
+
     if longname and meshnet_name:
         full_display_name = f"{longname}/{meshnet_name}"
         if meshnet_name != local_meshnet_name:
-            logger.info(f"Processing message from remote meshnet: {text}")
+            logger.info("Processing message from remote meshnet: %s", text)
             short_meshnet_name = meshnet_name[:4]
             # If shortname is None, truncate the longname to 3 characters
             if shortname is None:
@@ -189,39 +330,54 @@ async def on_room_message(
         full_display_name = display_name_response.displayname or event.sender
         short_display_name = full_display_name[:5]
         prefix = f"{short_display_name}[M]: "
-        logger.debug(f"Processing matrix message from [{full_display_name}]: {text}")
+        logger.debug("Processing matrix message from [%s]: %s", full_display_name, text)
         full_message = f"{prefix}{text}"
         text = truncate_message(text)
         truncated_message = f"{prefix}{text}"
 
+    # Plugins and replies use the radio the room is bound to
+    meshtastic_interface = get_room_interface(room_config)
+    current_interface.set(meshtastic_interface)
+
     # Plugin functionality
     plugins = load_plugins()
-    meshtastic_interface = connect_meshtastic()
     from meshtastic_utils import logger as meshtastic_logger
 
     found_matching_plugin = False
     for plugin in plugins:
         if not found_matching_plugin:
-            found_matching_plugin = await plugin.handle_room_message(
-                room, event, full_message
+            found_matching_plugin = await run_plugin_handler(
+                plugin, "handle_room_message", room, event, full_message
             )
             if found_matching_plugin:
-                logger.debug(f"Processed by plugin {plugin.plugin_name}")
+                logger.debug("Processed by plugin %s", plugin.plugin_name)
 
     meshtastic_channel = room_config["meshtastic_channel"]
 
     if not found_matching_plugin and event.sender != bot_user_id:
         if relay_config["meshtastic"]["broadcast_enabled"]:
             meshtastic_logger.info(
-                f"Relaying message from {full_display_name} to radio broadcast"
-            )
-            meshtastic_interface.sendText(
-                text=full_message, channelIndex=meshtastic_channel
+                "Relaying message from %s to radio broadcast", full_display_name
             )
+            try:
+                await get_radio(meshtastic_interface).send_text(
+                    text=full_message,
+                    channelIndex=meshtastic_channel,
+                    history={
+                        "sender": full_display_name,
+                        "text": text,
+                        "room_id": room.room_id,
+                        "channel": meshtastic_channel,
+                        # Wall clock time, as queued messages may be sent after a restart
+                        "received_time": time.time() - (time.monotonic() - received_at),
+                    },
+                )
+            except Exception as e:
+                meshtastic_logger.error("Error sending message to radio: %s", e)
 
         else:
             logger.debug(
-                f"Broadcast not supported: Message from {full_display_name} dropped."
+                "Broadcast not supported: Message from %s dropped.", full_display_name
             )
 
 
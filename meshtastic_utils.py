@@ -1,107 +1,687 @@
 import asyncio
+import contextvars
+import random
 import time
 import meshtastic.tcp_interface
 import meshtastic.serial_interface
 import meshtastic.ble_interface
+from meshtastic import admin_pb2
+from pubsub import pub
 from typing import List
 from config import relay_config
 from log_utils import get_logger
-from db_utils import get_longname, get_shortname
-from plugin_loader import load_plugins
+from db_utils import (
+    get_longname,
+    get_shortname,
+    enqueue_outbound_message,
+    get_outbound_messages,
+    delete_outbound_message,
+    count_outbound_messages,
+    save_node_snapshot,
+    get_node_snapshot,
+    save_node_metadata,
+    save_message_history,
+    update_longnames,
+    update_shortnames,
+)
+from dedup_utils import dedup_cache
+from transport_utils import MeshtasticTransport
+from plugin_loader import is_plugin_active, load_plugins, run_plugin_handler
+from metrics_utils import packets_received, queue_depth, reconnects, relay_latency
+from scheduler_utils import scheduler
 from bleak.exc import BleakDBusError, BleakError
 
 matrix_rooms: List[dict] = relay_config["matrix_rooms"]
 
 logger = get_logger(name="Meshtastic")
 
-meshtastic_client = None
-main_loop = None
+# Name of the radio the packet or room message being handled belongs to
+current_interface = contextvars.ContextVar("current_interface", default=None)
 
-def connect_meshtastic(force_connect=False):
-    global meshtastic_client
-    if meshtastic_client and not force_connect:
-        return meshtastic_client
 
-    # Ensure previous connection is closed
-    if meshtastic_client:
-        try:
-            meshtastic_client.close()
-        except Exception as e:
-            logger.warning(f"Error closing previous connection: {e}")
-        meshtastic_client = None
+def get_interface_configs():
+    """
+    Return the configured radios by name.
+
+    Without a `meshtastic.interfaces` section the single legacy connection
+    settings are used as a radio named `default`.
+    """
+    interfaces = relay_config["meshtastic"].get("interfaces")
+    if interfaces:
+        return interfaces
+    return {"default": relay_config["meshtastic"]}
+
+
+# NodeDB fields kept in the snapshot, with the sub-fields kept for nested ones
+snapshot_fields = {
+    "num": None,
+    "user": ("id", "longName", "shortName", "hwModel", "role"),
+    "position": ("latitude", "longitude", "altitude", "time"),
+    "deviceMetrics": None,
+    "snr": None,
+    "lastHeard": None,
+    "hopsAway": None,
+}
+
+
+def compact_node(node):
+    """Strip a NodeDB entry down to the JSON serializable fields the plugins use."""
+    compact = {}
+    for field, subfields in snapshot_fields.items():
+        value = node.get(field)
+        if value is None:
+            continue
+        if subfields:
+            value = {key: value[key] for key in subfields if key in value}
+        compact[field] = value
+    return compact
+
+
+class ConnectionSupervisor:
+    """
+    Watches the radio link from the event loop and reconnects when it drops.
 
-    # Initialize Meshtastic interface
-    connection_type = relay_config["meshtastic"]["connection_type"]
-    retry_limit = relay_config["meshtastic"].get("retry_limit", 3)
-    attempts = 1
-    successful = False
+    The link is considered healthy while packets arrive. After a quiet period sized
+    to the link type the radio is asked for its device metadata, and a link that
+    sends nothing back within `heartbeat_timeout` or a lost connection event
+    triggers an immediate reconnect with jittered exponential backoff. A write
+    succeeding is not enough, as half-open TCP and serial links still accept them.
+    State changes are published on the `mmrelay.meshtastic.state` pubsub topic.
+    """
 
-    while not successful and attempts <= retry_limit:
+    # Seconds without a received packet before the radio is probed
+    heartbeat_intervals = {"serial": 120, "network": 60, "ble": 30}
+    heartbeat_timeout = 15
+    backoff_base = 1
+    backoff_cap = 300
+
+    def __init__(self, radio):
+        self.radio = radio
+        connection_type = radio.config["connection_type"]
+        self.heartbeat_interval = radio.setting(
+            "heartbeat_interval", self.heartbeat_intervals.get(connection_type, 60)
+        )
+        self.heartbeat_timeout = radio.setting(
+            "heartbeat_timeout", self.heartbeat_timeout
+        )
+        self.state = "disconnected"
+        self.last_packet_time = time.monotonic()
+        self.lost_time = None
+        self.reconnect_count = 0
+        self.last_reconnect_latency = None
+        self.loop = None
+        self._reconnect_task = None
+        self._watchdog_task = None
+
+    def set_state(self, state):
+        if state == self.state:
+            return
+        previous, self.state = self.state, state
+        logger.debug("Connection state of %s %s -> %s", self.radio.name, previous, state)
+        pub.sendMessage(
+            "mmrelay.meshtastic.state",
+            state=state,
+            previous=previous,
+            interface_name=self.radio.name,
+        )
+
+    def start(self):
+        self.loop = asyncio.get_running_loop()
+        if self.radio.client:
+            self.set_state("connected")
+        else:
+            self.connection_lost()
+        self._watchdog_task = self.loop.create_task(self._watchdog())
+
+    def packet_received(self):
+        self.last_packet_time = time.monotonic()
+
+    def connection_lost(self):
+        """Start reconnecting. Safe to call from any thread."""
+        if self.loop is None:
+            return
         try:
-            if connection_type == "serial":
-                serial_port = relay_config["meshtastic"]["serial_port"]
-                logger.info(f"Connecting to serial port {serial_port} ...")
-                meshtastic_client = meshtastic.serial_interface.SerialInterface(serial_port)
-            
-            elif connection_type == "ble":
-                ble_address = relay_config["meshtastic"].get("ble_address")
-                if ble_address:
-                    logger.info(f"Connecting to BLE address {ble_address} ...")
-                    meshtastic_client = meshtastic.ble_interface.BLEInterface(
-                        address=ble_address, 
-                        noProto=False, 
-                        debugOut=None, 
-                        noNodes=False
+            running_loop = asyncio.get_running_loop()
+        except RuntimeError:
+            running_loop = None
+        if running_loop is self.loop:
+            self._start_reconnect()
+        else:
+            self.loop.call_soon_threadsafe(self._start_reconnect)
+
+    def _start_reconnect(self):
+        if self._reconnect_task and not self._reconnect_task.done():
+            return
+        self.lost_time = time.monotonic()
+        self.set_state("disconnected")
+        self._reconnect_task = self.loop.create_task(self._reconnect())
+
+    async def _reconnect(self):
+        attempt = 0
+        while True:
+            self.set_state("connecting")
+            if self.radio.client:
+                # Keep serving the nodes heard so far while reconnecting
+                try:
+                    await self.loop.run_in_executor(None, self.radio.save_node_snapshot)
+                except Exception as e:
+                    logger.warning(f"Error saving nodes of {self.radio.name}: {e}")
+            old_client, self.radio.client = self.radio.client, None
+            try:
+                if old_client:
+                    await self.loop.run_in_executor(
+                        None, close_meshtastic_interface, old_client
                     )
+                self.radio.client = await self.loop.run_in_executor(
+                    None, self.radio.open_interface
+                )
+                break
+            except Exception as e:
+                delay = min(self.backoff_cap, self.backoff_base * 2**attempt)
+                delay *= random.uniform(0.5, 1.5)
+                attempt += 1
+                logger.warning(
+                    f"Reconnection attempt #{attempt} to {self.radio.name} failed, retrying in {delay:.1f} secs: {e}"
+                )
+                self.set_state("disconnected")
+                await asyncio.sleep(delay)
+
+        self.reconnect_count += 1
+        reconnects.labels(self.radio.name).inc()
+        self.last_reconnect_latency = time.monotonic() - self.lost_time
+        self.last_packet_time = time.monotonic()
+        logger.info(
+            f"Reconnected {self.radio.name} successfully in {self.last_reconnect_latency:.1f} secs"
+        )
+        self.set_state("connected")
+
+    async def _watchdog(self):
+        while True:
+            await asyncio.sleep(self.heartbeat_interval / 4)
+            if self.state != "connected":
+                continue
+            if time.monotonic() - self.last_packet_time < self.heartbeat_interval:
+                continue
+
+            if not await self.probe():
+                logger.error(f"No response from {self.radio.name}, connection lost")
+                self.connection_lost()
+
+    async def probe(self):
+        """
+        Send a request to the radio and wait for anything to be received from it.
+
+        :return: True if the radio answered within `heartbeat_timeout` seconds.
+        """
+        message = admin_pb2.AdminMessage()
+        message.get_device_metadata_request = True
+        sent_time = time.monotonic()
+        deadline = sent_time + self.heartbeat_timeout
+        try:
+            await asyncio.wait_for(
+                self.radio.transport.send_admin(
+                    message, on_response=lambda packet: self.packet_received()
+                ),
+                timeout=self.heartbeat_timeout,
+            )
+        except Exception as e:
+            logger.warning(f"Probe of {self.radio.name} failed: {e}")
+            return False
+
+        while self.last_packet_time < sent_time:
+            if time.monotonic() >= deadline:
+                return False
+            await asyncio.sleep(0.5)
+        return True
+
+    def stats(self):
+        return {
+            "state": self.state,
+            "reconnects": self.reconnect_count,
+            "last_reconnect_latency": self.last_reconnect_latency,
+            "seconds_since_last_packet": time.monotonic() - self.last_packet_time,
+        }
+
+
+class MeshtasticRadio:
+    """
+    A named radio with its own connection, supervisor, transmit transport and
+    ingestion queue. Received packets are queued from the meshtastic thread and
+    processed in order on the event loop.
+
+    Messages for the radio that cannot be sent while the link is down are kept in
+    a durable outbound queue and sent once the supervisor reports it is back.
+    """
+
+    ingestion_queue_size = 1000
+
+    def __init__(self, name, config):
+        self.name = name
+        self.config = config
+        self.client = None
+        self.transport = MeshtasticTransport(lambda: self.client, name=name)
+        self.supervisor = ConnectionSupervisor(self)
+        self.queue = None
+        self.loop = None
+        self._consumer_task = None
+        self.outbound_queue_size = self.setting("outbound_queue_size", 100)
+        self.outbound_ttl = self.setting("outbound_queue_ttl", 1800)
+        self.outbound_pending = True  # Unknown until the queue is drained once
+        self._drain_task = None
+        self.node_snapshot = None
+        self.my_node_id = None
+        pub.subscribe(self._on_state_change, "mmrelay.meshtastic.state")
+
+        queue_depth.set_function(
+            lambda: self.queue.qsize() if self.queue else 0, "ingestion", name
+        )
+        queue_depth.set_function(self.transport.queue_depth, "transmit", name)
+        queue_depth.set_function(
+            lambda: count_outbound_messages(name), "outbound", name
+        )
+
+    def setting(self, key, default=None):
+        """Look a setting up for this radio, falling back to the `meshtastic` section."""
+        return self.config.get(key, relay_config["meshtastic"].get(key, default))
+
+    def update_config(self, config):
+        """Apply reloaded settings. Connection settings take effect on the next reconnect."""
+        self.config = config
+        self.outbound_queue_size = self.setting("outbound_queue_size", 100)
+        self.outbound_ttl = self.setting("outbound_queue_ttl", 1800)
+
+    def open_interface(self):
+        """
+        Make a single attempt to open the radio interface.
+
+        :return: The connected interface. Raises if the radio cannot be reached.
+        """
+        connection_type = self.config["connection_type"]
+
+        if connection_type == "serial":
+            serial_port = self.config["serial_port"]
+            logger.info(f"Connecting to serial port {serial_port} ...")
+            client = meshtastic.serial_interface.SerialInterface(serial_port)
+
+        elif connection_type == "ble":
+            ble_address = self.config.get("ble_address")
+            if not ble_address:
+                raise ValueError("No BLE address provided.")
+            logger.info(f"Connecting to BLE address {ble_address} ...")
+            client = meshtastic.ble_interface.BLEInterface(
+                address=ble_address,
+                noProto=False,
+                debugOut=None,
+                noNodes=False
+            )
+
+        else:
+            target_host = self.config["host"]
+            logger.info(f"Connecting to host {target_host} ...")
+            client = meshtastic.tcp_interface.TCPInterface(hostname=target_host)
+
+        nodeInfo = client.getMyNodeInfo()
+        self.my_node_id = nodeInfo["user"]["id"]
+        logger.info(f"Connected {self.name} to {nodeInfo['user']['shortName']} / {nodeInfo['user']['hwModel']}")
+        return client
+
+    def connect(self, force_connect=False):
+        if self.client and not force_connect:
+            return self.client
+
+        # Ensure previous connection is closed
+        if self.client:
+            close_meshtastic_interface(self.client)
+            self.client = None
+
+        # Initialize Meshtastic interface
+        retry_limit = self.setting("retry_limit", 3)
+        attempts = 1
+
+        while attempts <= retry_limit:
+            try:
+                self.client = self.open_interface()
+                return self.client
+
+            except ValueError as e:
+                logger.error(str(e))
+                return None
+
+            except (BleakDBusError, BleakError, meshtastic.ble_interface.BLEInterface.BLEError, Exception) as e:
+                attempts += 1
+                if attempts <= retry_limit:
+                    logger.warning(f"Attempt #{attempts-1} failed. Retrying in {attempts} secs {e}")
+                    time.sleep(attempts)
                 else:
-                    logger.error("No BLE address provided.")
+                    logger.error(f"Could not connect: {e}")
                     return None
-            
-            else:
-                target_host = relay_config["meshtastic"]["host"]
-                logger.info(f"Connecting to host {target_host} ...")
-                meshtastic_client = meshtastic.tcp_interface.TCPInterface(hostname=target_host)
-
-            successful = True
-            nodeInfo = meshtastic_client.getMyNodeInfo()
-            logger.info(f"Connected to {nodeInfo['user']['shortName']} / {nodeInfo['user']['hwModel']}")
-        
-        except (BleakDBusError, BleakError, meshtastic.ble_interface.BLEInterface.BLEError, Exception) as e:
-            attempts += 1
-            if attempts <= retry_limit:
-                logger.warning(f"Attempt #{attempts-1} failed. Retrying in {attempts} secs {e}")
-                time.sleep(attempts)
-            else:
-                logger.error(f"Could not connect: {e}")
-                return None
 
-    return meshtastic_client
+        return self.client
 
-def on_lost_meshtastic_connection(interface=None):
-    logger.error("Lost connection. Reconnecting...")
-    global main_loop
-    if main_loop:
-        asyncio.run_coroutine_threadsafe(reconnect(), main_loop)
-
-async def reconnect():
-    backoff_time = 10
-    while True:
+    def get_nodes(self):
+        """
+        Return the NodeDB of the radio, keyed by node ID.
+
+        The stored snapshot is only served until the radio has streamed its
+        NodeDB, so nodes the radio has since dropped are not kept around.
+        """
+        if self.client and self.client.nodes:
+            return dict(self.client.nodes)
+        return dict(self.load_node_snapshot())
+
+    def load_node_snapshot(self):
+        if self.node_snapshot is None:
+            # Nodes stored before their NODEINFO was known lack "user", skip them
+            self.node_snapshot = {
+                node_id: node
+                for node_id, node in get_node_snapshot(self.name).items()
+                if "user" in node
+            }
+        return self.node_snapshot
+
+    def save_node_snapshot(self):
+        """Replace the stored snapshot with the live NodeDB of the radio."""
+        if not (self.client and self.client.nodes):
+            return
+        self.node_snapshot = {
+            node_id: compact_node(node)
+            for node_id, node in self.get_nodes().items()
+            if "user" in node
+        }
+        save_node_snapshot(self.name, self.node_snapshot)
+        logger.debug("Saved %d nodes of %s", len(self.node_snapshot), self.name)
+
+    def update_node(self, node_id, fields):
+        """
+        Merge node metadata from a received packet into the snapshot and save
+        it. Safe to call from any thread.
+
+        Nodes are only stored once their user is known, from NODEINFO or the
+        radio's NodeDB, since plugins rely on every node having a "user".
+        """
+        snapshot = self.load_node_snapshot()
+        known = snapshot.get(node_id)
+        if known is None and self.client and self.client.nodes:
+            known = self.client.nodes.get(node_id)
+        node = compact_node({**(known or {}), **fields})
+        if "user" not in node:
+            return
+        snapshot[node_id] = node
+        save_node_metadata(self.name, node_id, node)
+
+    def record_nodes(self):
+        """Save the whole NodeDB streamed by the radio on connect, with the node names."""
+        if not (self.client and self.client.nodes):
+            return
+        self.save_node_snapshot()
+        update_longnames(self.node_snapshot)
+        update_shortnames(self.node_snapshot)
+
+    def start(self):
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue(maxsize=self.ingestion_queue_size)
+        self._consumer_task = self.loop.create_task(self._consume())
+        self.supervisor.start()
+        self._start_drain()
+
+    def enqueue_packet(self, packet):
+        """Queue a received packet. Safe to call from any thread."""
+        if self.loop is None:
+            logger.debug("Dropping packet received before %s was started", self.name)
+            return
+        self.loop.call_soon_threadsafe(self._put_packet, packet, time.monotonic())
+
+    def _put_packet(self, packet, received_at):
         try:
-            logger.info(f"Reconnection attempt starting in {backoff_time} seconds...")
-            await asyncio.sleep(backoff_time)
-            meshtastic_client = connect_meshtastic(force_connect=True)
-            if meshtastic_client:
-                logger.info("Reconnected successfully.")
+            self.queue.put_nowait((packet, received_at))
+        except asyncio.QueueFull:
+            logger.warning("Ingestion queue of %s is full, dropping packet", self.name)
+
+    async def send_text(self, text, channelIndex=0, history=None):
+        """
+        Send a text message, or queue it durably if the link is down or older
+        messages are still waiting, so that they go out in order.
+
+        :param history: For messages relayed from Matrix, the `sender`, `text`,
+            `room_id`, `channel` and `received_time` to record in the message history
+            and relay latency once the message has actually been sent.
+        :return: The sent packet, or None if the message was queued.
+        """
+        if self.supervisor.state == "connected" and not self.outbound_pending:
+            try:
+                packet = await self.transport.send_text(
+                    text=text, channelIndex=channelIndex
+                )
+                self._record_sent(history)
+                return packet
+            except Exception as e:
+                logger.warning("Error sending message to %s, queueing it: %s", self.name, e)
+
+        enqueue_outbound_message(
+            self.name,
+            channelIndex,
+            text,
+            time.time() + self.outbound_ttl,
+            self.outbound_queue_size,
+            history,
+        )
+        self.outbound_pending = True
+        logger.info("Queued message for %s until the radio is connected", self.name)
+        self._start_drain()
+
+    def _record_sent(self, history):
+        if history is None:
+            return
+        relay_latency.labels("matrix_to_mesh").observe(
+            time.time() - history["received_time"]
+        )
+        if is_plugin_active("history"):
+            save_message_history(
+                "matrix_to_mesh",
+                history["sender"],
+                history["text"],
+                room_id=history["room_id"],
+                channel=history["channel"],
+            )
+
+    def _on_state_change(self, state, previous, interface_name):
+        if interface_name == self.name and state == "connected":
+            self.record_nodes()
+            self._start_drain()
+
+    def _start_drain(self):
+        if self.supervisor.state != "connected":
+            return
+        if self._drain_task and not self._drain_task.done():
+            return
+        self._drain_task = self.loop.create_task(self._drain_outbound())
+
+    async def _drain_outbound(self):
+        sent = 0
+        failures = 0
+        while self.supervisor.state == "connected":
+            messages = await self.loop.run_in_executor(
+                None, get_outbound_messages, self.name
+            )
+            if not messages:
+                self.outbound_pending = False
                 break
-        except Exception as e:
-            logger.error(f"Reconnection attempt failed: {e}")
-            backoff_time = min(backoff_time * 2, 300)  # Cap backoff at 5 minutes
 
-def on_meshtastic_message(packet, loop=None):
+            for message_id, channel, text, expires, history in messages:
+                if expires < time.time():
+                    logger.warning("Dropping expired queued message for %s", self.name)
+                    delete_outbound_message(message_id)
+                    continue
+                try:
+                    await self.transport.send_text(text=text, channelIndex=channel)
+                except Exception as e:
+                    # Retry from the oldest message until the radio takes it or the link drops
+                    delay = min(
+                        self.supervisor.backoff_cap,
+                        self.supervisor.backoff_base * 2**failures,
+                    )
+                    failures += 1
+                    logger.warning(
+                        "Error sending queued message to %s, retrying in %.1f secs: %s",
+                        self.name,
+                        delay,
+                        e,
+                    )
+                    await asyncio.sleep(delay)
+                    break
+                failures = 0
+                delete_outbound_message(message_id)
+                self._record_sent(history)
+                sent += 1
+
+        if sent:
+            logger.info(f"Sent {sent} queued message(s) to {self.name}")
+
+    async def _consume(self):
+        current_interface.set(self.name)
+        while True:
+            packet, received_at = await self.queue.get()
+            try:
+                await process_meshtastic_packet(packet, self, received_at)
+            except Exception as e:
+                logger.error("Error processing packet from %s: %s", self.name, e)
+
+
+radios = {
+    name: MeshtasticRadio(name, config)
+    for name, config in get_interface_configs().items()
+}
+default_interface_name = next(iter(radios))
+
+
+def get_radio(interface_name=None):
+    """
+    Return the named radio, defaulting to the radio of the packet or room
+    being handled and then to the first configured radio.
+    """
+    return radios[interface_name or current_interface.get() or default_interface_name]
+
+
+def get_transport(interface_name=None):
+    return get_radio(interface_name).transport
+
+
+def get_nodes(interface_name=None):
+    return get_radio(interface_name).get_nodes()
+
+
+def get_my_node_id(interface_name=None):
+    """Return the node ID of the radio, looked up once per connection."""
+    return get_radio(interface_name).my_node_id
+
+
+def save_node_snapshots():
+    for radio in radios.values():
+        radio.save_node_snapshot()
+
+
+def get_room_interface(room):
+    return room.get("meshtastic_interface", default_interface_name)
+
+
+def close_meshtastic_interface(client):
+    try:
+        client.close()
+    except Exception as e:
+        logger.warning(f"Error closing previous connection: {e}")
+
+
+def connect_meshtastic(force_connect=False, interface_name=None):
+    return get_radio(interface_name).connect(force_connect=force_connect)
+
+
+def schedule_node_snapshots():
+    scheduler.add_job(
+        "node_snapshot",
+        save_node_snapshots,
+        minutes=relay_config["meshtastic"].get("node_snapshot_interval", 5),
+    )
+
+
+def start_radios():
+    for radio in radios.values():
+        radio.start()
+    schedule_node_snapshots()
+
+
+def update_radio_configs():
+    """
+    Point the running radios at their settings in the reloaded config.
+
+    The connections are kept open. Radios added to or removed from the config
+    are only picked up on restart.
+    """
+    configs = get_interface_configs()
+    for name, radio in radios.items():
+        if name in configs:
+            radio.update_config(configs[name])
+        else:
+            logger.warning(f"Radio {name} was removed from the config, restart to disconnect it")
+    for name in configs:
+        if name not in radios:
+            logger.warning(f"Radio {name} was added to the config, restart to connect it")
+    schedule_node_snapshots()
+
+
+def find_radio(interface):
+    for radio in radios.values():
+        if radio.client is interface:
+            return radio
+    return None
+
+
+def on_lost_meshtastic_connection(interface=None):
+    radio = find_radio(interface) if interface else get_radio()
+    if radio is None:
+        # A previously closed interface
+        return
+    logger.error(f"Lost connection to {radio.name}. Reconnecting...")
+    radio.supervisor.connection_lost()
+
+
+def on_meshtastic_message(packet, interface=None, loop=None):
+    radio = find_radio(interface) if interface else get_radio()
+    if radio is None:
+        logger.debug("Dropping packet from an unknown interface")
+        return
+    radio.supervisor.packet_received()
+    packets_received.labels(
+        radio.name, packet.get("decoded", {}).get("portnum", "ENCRYPTED")
+    ).inc()
+    radio.enqueue_packet(packet)
+
+
+def on_node_metadata(packet, interface=None):
+    """Update names, hardware model and position of a node from NODEINFO/POSITION packets."""
+    radio = find_radio(interface) if interface else get_radio()
+    node_id = packet.get("fromId")
+    if radio is None or not node_id:
+        return
+
+    decoded = packet.get("decoded", {})
+    portnum = decoded.get("portnum")
+    if portnum == "NODEINFO_APP" and decoded.get("user"):
+        user = {"id": node_id, **decoded["user"]}
+        radio.update_node(node_id, {"num": packet.get("from"), "user": user})
+    elif portnum == "POSITION_APP" and "latitude" in decoded.get("position", {}):
+        radio.update_node(node_id, {"position": decoded["position"]})
+
+
+async def process_meshtastic_packet(packet, radio, received_at=None):
     from matrix_utils import matrix_relay
 
     sender = packet["fromId"]
 
+    # Drop packets already relayed, e.g. heard by several bridged relays
+    if dedup_cache.seen(packet.get("from"), packet.get("id")):
+        logger.debug("Skipping duplicate packet %s from %s", packet.get("id"), sender)
+        return
+
     if "text" in packet["decoded"] and packet["decoded"]["text"]:
         text = packet["decoded"]["text"]
 
@@ -111,21 +691,22 @@ def on_meshtastic_message(packet, loop=None):
             if packet["decoded"]["portnum"] == "TEXT_MESSAGE_APP":
                 channel = 0
             else:
-                logger.debug(f"Unknown packet")
+                logger.debug("Unknown packet")
                 return
 
         # Check if the channel is mapped to a Matrix room in the configuration
-        channel_mapped = False
-        for room in matrix_rooms:
-            if room["meshtastic_channel"] == channel:
-                channel_mapped = True
-                break
+        rooms = [
+            room
+            for room in matrix_rooms
+            if room["meshtastic_channel"] == channel
+            and get_room_interface(room) == radio.name
+        ]
 
-        if not channel_mapped:
-            logger.debug(f"Skipping message from unmapped channel {channel}")
+        if not rooms:
+            logger.debug("Skipping message from unmapped channel %s on %s", channel, radio.name)
             return
 
-        logger.info(f"Processing inbound radio message from {sender} on channel {channel}")
+        logger.info("Processing inbound radio message from %s on channel %s", sender, channel)
 
         longname = get_longname(sender) or sender
         shortname = get_shortname(sender) or sender
@@ -139,32 +720,44 @@ def on_meshtastic_message(packet, loop=None):
         found_matching_plugin = False
         for plugin in plugins:
             if not found_matching_plugin:
-                result = asyncio.run_coroutine_threadsafe(
-                    plugin.handle_meshtastic_message(
-                        packet, formatted_message, longname, meshnet_name
-                    ),
-                    loop=loop,
+                found_matching_plugin = await run_plugin_handler(
+                    plugin,
+                    "handle_meshtastic_message",
+                    packet,
+                    formatted_message,
+                    longname,
+                    meshnet_name,
                 )
-                found_matching_plugin = result.result()
                 if found_matching_plugin:
-                    logger.debug(f"Processed by plugin {plugin.plugin_name}")
+                    logger.debug("Processed by plugin %s", plugin.plugin_name)
 
         if found_matching_plugin:
             return
 
-        logger.info(f"Relaying Meshtastic message from {longname} to Matrix: {formatted_message}")
-
-        for room in matrix_rooms:
-            if room["meshtastic_channel"] == channel:
-                asyncio.run_coroutine_threadsafe(
-                    matrix_relay(
-                        room["id"],
-                        formatted_message,
-                        longname,
-                        shortname,
-                        meshnet_name,
-                    ),
-                    loop=loop,
+        logger.info("Relaying Meshtastic message from %s to Matrix: %s", longname, formatted_message)
+
+        for room in rooms:
+            relayed = await matrix_relay(
+                room["id"],
+                formatted_message,
+                longname,
+                shortname,
+                meshnet_name,
+                meshtastic_from=packet.get("from"),
+                packet_id=packet.get("id"),
+            )
+            if relayed and received_at is not None:
+                relay_latency.labels("mesh_to_matrix").observe(
+                    time.monotonic() - received_at
+                )
+            if relayed and is_plugin_active("history"):
+                save_message_history(
+                    "mesh_to_matrix",
+                    longname,
+                    text,
+                    meshtastic_id=sender,
+                    room_id=room["id"],
+                    channel=channel,
                 )
     else:
         portnum = packet["decoded"]["portnum"]
@@ -173,31 +766,21 @@ def on_meshtastic_message(packet, loop=None):
         found_matching_plugin = False
         for plugin in plugins:
             if not found_matching_plugin:
-                result = asyncio.run_coroutine_threadsafe(
-                    plugin.handle_meshtastic_message(
-                        packet, formatted_message=None, longname=None, meshnet_name=None
-                    ),
-                    loop=loop,
+                found_matching_plugin = await run_plugin_handler(
+                    plugin,
+                    "handle_meshtastic_message",
+                    packet,
+                    formatted_message=None,
+                    longname=None,
+                    meshnet_name=None,
                 )
-                found_matching_plugin = result.result()
                 if found_matching_plugin:
-                    logger.debug(f"Processed {portnum} with plugin {plugin.plugin_name}")
+                    logger.debug("Processed %s with plugin %s", portnum, plugin.plugin_name)
 
-async def check_connection():
-    global meshtastic_client
-    connection_type = relay_config["meshtastic"]["connection_type"]
-    while True:
-        if meshtastic_client:
-            try:
-                # Attempt a read operation to check if the connection is alive
-                meshtastic_client.getMyNodeInfo()
-            except (BleakDBusError, BleakError, meshtastic.ble_interface.BLEInterface.BLEError, Exception) as e:
-                logger.error(f"{connection_type.capitalize()} connection lost: {e}")
-                on_lost_meshtastic_connection(meshtastic_client)
-        await asyncio.sleep(5)  # Check connection every 5 seconds
 
 if __name__ == "__main__":
-    meshtastic_client = connect_meshtastic()
+    for radio in radios.values():
+        radio.connect()
     main_loop = asyncio.get_event_loop()
-    main_loop.create_task(check_connection())
+    main_loop.call_soon(start_radios)
     main_loop.run_forever()
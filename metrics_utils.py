@@ -0,0 +1,297 @@
+import asyncio
+import bisect
+import functools
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from config import relay_config
+from log_utils import get_logger
+
+logger = get_logger(name="Metrics")
+
+default_buckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+registry = []
+
+
+def format_labels(labelnames, labelvalues, extra=None):
+    pairs = list(zip(labelnames, labelvalues))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    escaped = [
+        '%s="%s"' % (name, str(value).replace("\\", "\\\\").replace('"', '\\"'))
+        for name, value in pairs
+    ]
+    return "{" + ",".join(escaped) + "}"
+
+
+class Metric:
+    metric_type = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        registry.append(self)
+
+    def labels(self, *labelvalues):
+        return _BoundMetric(self, tuple(str(value) for value in labelvalues))
+
+    def render(self):
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.metric_type}",
+        ]
+        with self._lock:
+            items = list(self._values.items())
+        for labelvalues, value in items:
+            lines.extend(self.render_value(labelvalues, value))
+        return lines
+
+    def render_value(self, labelvalues, value):
+        return [f"{self.name}{format_labels(self.labelnames, labelvalues)} {value}"]
+
+
+class _BoundMetric:
+    def __init__(self, metric, labelvalues):
+        self.metric = metric
+        self.labelvalues = labelvalues
+
+    def inc(self, amount=1):
+        self.metric.inc(amount, self.labelvalues)
+
+    def set(self, value):
+        self.metric.set(value, self.labelvalues)
+
+    def observe(self, value):
+        self.metric.observe(value, self.labelvalues)
+
+    @contextmanager
+    def time(self):
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start_time)
+
+
+class Counter(Metric):
+    metric_type = "counter"
+
+    def inc(self, amount=1, labelvalues=()):
+        with self._lock:
+            self._values[labelvalues] = self._values.get(labelvalues, 0) + amount
+
+
+class Gauge(Metric):
+    """A gauge set directly or read from a callback when scraped."""
+
+    metric_type = "gauge"
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self._callbacks = {}
+
+    def set(self, value, labelvalues=()):
+        with self._lock:
+            self._values[labelvalues] = value
+
+    def set_function(self, func, *labelvalues):
+        self._callbacks[tuple(str(value) for value in labelvalues)] = func
+
+    def render(self):
+        for labelvalues, func in list(self._callbacks.items()):
+            try:
+                self.set(func(), labelvalues)
+            except Exception as e:
+                logger.debug("Error reading gauge %s: %s", self.name, e)
+        return super().render()
+
+
+class Histogram(Metric):
+    metric_type = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=default_buckets):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, labelvalues=()):
+        with self._lock:
+            counts, total = self._values.get(
+                labelvalues, ([0] * (len(self.buckets) + 1), 0.0)
+            )
+            counts[bisect.bisect_left(self.buckets, value)] += 1
+            self._values[labelvalues] = (counts, total + value)
+
+    def render_value(self, labelvalues, value):
+        counts, total = value
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + ("+Inf",), counts):
+            cumulative += count
+            labels = format_labels(self.labelnames, labelvalues, ("le", bound))
+            lines.append(f"{self.name}_bucket{labels} {cumulative}")
+        labels = format_labels(self.labelnames, labelvalues)
+        lines.append(f"{self.name}_sum{labels} {total}")
+        lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class LatencyWindow:
+    """Rolling window of recent durations for percentile summaries."""
+
+    def __init__(self, size=500):
+        self.samples = deque(maxlen=size)
+        self.count = 0
+        self.slow_count = 0
+
+    def add(self, duration, slow=False):
+        self.samples.append(duration)
+        self.count += 1
+        if slow:
+            self.slow_count += 1
+
+    def percentile(self, percent):
+        if not self.samples:
+            return None
+        ordered = sorted(self.samples)
+        index = min(len(ordered) - 1, int(round(percent / 100 * (len(ordered) - 1))))
+        return ordered[index]
+
+    def summary(self):
+        return {
+            "count": self.count,
+            "slow": self.slow_count,
+            "p50": self.percentile(50),
+            "p95": self.percentile(95),
+            "p99": self.percentile(99),
+            "max": max(self.samples) if self.samples else None,
+        }
+
+
+def render_metrics():
+    lines = []
+    for metric in registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+packets_received = Counter(
+    "mmrelay_packets_received_total",
+    "Radio packets received",
+    ["interface", "portnum"],
+)
+relay_latency = Histogram(
+    "mmrelay_relay_latency_seconds",
+    "Time from receiving a message to relaying it",
+    ["direction"],
+)
+plugin_handler_duration = Histogram(
+    "mmrelay_plugin_handler_seconds",
+    "Duration of plugin message handlers",
+    ["plugin", "handler"],
+)
+matrix_send_failures = Counter(
+    "mmrelay_matrix_send_failures_total",
+    "Failed Matrix sends",
+    ["reason"],
+)
+db_operation_duration = Histogram(
+    "mmrelay_db_operation_seconds",
+    "Duration of database operations",
+    ["operation"],
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1),
+)
+queue_depth = Gauge(
+    "mmrelay_queue_depth",
+    "Items waiting in relay queues",
+    ["queue", "interface"],
+)
+reconnects = Counter(
+    "mmrelay_reconnects_total",
+    "Radio reconnections",
+    ["interface"],
+)
+plugin_failures = Counter(
+    "mmrelay_plugin_failures_total",
+    "Plugin handler calls that timed out or raised",
+    ["plugin", "handler", "reason"],
+)
+plugin_circuit_open = Gauge(
+    "mmrelay_plugin_circuit_open",
+    "1 while a plugin is bypassed by its circuit breaker",
+    ["plugin"],
+)
+plugin_worker_restarts = Counter(
+    "mmrelay_plugin_worker_restarts_total",
+    "Restarts of isolated plugin worker processes",
+    ["plugin"],
+)
+mesh_relay_packets = Counter(
+    "mmrelay_mesh_relay_packets_total",
+    "Packets considered by the mesh_relay plugin",
+    ["portnum", "result"],
+)
+
+
+def timed_db_operation(func):
+    """Decorator recording the duration of a database function."""
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        with db_operation_duration.labels(func.__name__).time():
+            return func(*args, **kwargs)
+
+    return wrapper
+
+
+async def handle_metrics_request(reader, writer):
+    try:
+        request_line = await asyncio.wait_for(reader.readline(), timeout=5)
+        # Discard the request headers
+        while (await asyncio.wait_for(reader.readline(), timeout=5)) not in (
+            b"\r\n",
+            b"\n",
+            b"",
+        ):
+            pass
+
+        parts = request_line.decode("latin-1").split()
+        if len(parts) >= 2 and parts[0] == "GET" and parts[1].split("?")[0] == "/metrics":
+            status, body = "200 OK", render_metrics()
+        else:
+            status, body = "404 Not Found", "Not Found\n"
+
+        payload = body.encode("utf-8")
+        writer.write(
+            (
+                f"HTTP/1.1 {status}\r\n"
+                "Content-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+                f"Content-Length: {len(payload)}\r\n"
+                "Connection: close\r\n\r\n"
+            ).encode("latin-1")
+            + payload
+        )
+        await writer.drain()
+    except Exception as e:
+        logger.debug("Error serving metrics request: %s", e)
+    finally:
+        writer.close()
+
+
+async def start_metrics_server():
+    """Serve /metrics over HTTP if enabled in the `metrics` section of config.yaml."""
+    metrics_config = relay_config.get("metrics") or {}
+    if not metrics_config.get("enabled", False):
+        return None
+
+    host = metrics_config.get("host", "127.0.0.1")
+    port = metrics_config.get("port", 9877)
+    server = await asyncio.start_server(handle_metrics_request, host, port)
+    logger.info(f"Serving metrics on http://{host}:{port}/metrics")
+    return server
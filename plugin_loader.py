@@ -1,64 +1,288 @@
+import asyncio
+import importlib
+import importlib.util
+import os
+import sys
+import time
+from config import relay_config
 from log_utils import get_logger
+from metrics_utils import (
+    LatencyWindow,
+    plugin_circuit_open,
+    plugin_failures,
+    plugin_handler_duration,
+)
 
 logger = get_logger(name="Plugins")
 
+# Built-in plugins by name, imported only when active in config.yaml
+plugin_registry = {
+    "health": "plugins.health_plugin",
+    "map": "plugins.map_plugin",
+    "mesh_relay": "plugins.mesh_relay_plugin",
+    "ping": "plugins.ping_plugin",
+    "telemetry": "plugins.telemetry_plugin",
+    "weather": "plugins.weather_plugin",
+    "help": "plugins.help_plugin",
+    "nodes": "plugins.nodes_plugin",
+    "drop": "plugins.drop_plugin",
+    "debug": "plugins.debug_plugin",
+    "chutilz": "plugins.chutilz_plugin",
+    "airutilz": "plugins.airutilz_plugin",
+    "voltage": "plugins.voltage_plugin",
+    "battery": "plugins.battery_plugin",
+    "snr": "plugins.snr_plugin",
+    "stats": "plugins.stats_plugin",
+    "history": "plugins.history_plugin",
+    "reload": "plugins.reload_plugin",
+}
+
+custom_plugins_dir = os.path.join(os.path.dirname(__file__), "custom_plugins")
+
 sorted_active_plugins = []
+plugins_loaded = False
+
+# Recent handler durations by (plugin name, handler)
+plugin_latencies = {}
+
+
+class CircuitBreaker:
+    """
+    Bypasses a plugin after `failure_threshold` consecutive failed calls.
+
+    After `retry_after` seconds the breaker is half-open: a single trial call is
+    let through and the others are still bypassed until it completes. If it
+    fails the plugin is bypassed again for twice as long, up to `max_retry_after`.
+    """
+
+    max_retry_after = 3600
+
+    def __init__(self, plugin_name, failure_threshold=3, retry_after=30):
+        self.plugin_name = plugin_name
+        self.failure_threshold = failure_threshold
+        self.retry_after = retry_after
+        self.failures = 0
+        self.trips = 0
+        self.open_until = None
+        self.trial_running = False
+
+    @property
+    def is_open(self):
+        return self.open_until is not None
+
+    def allow(self):
+        if self.open_until is None:
+            return True
+        if self.trial_running or time.monotonic() < self.open_until:
+            return False
+        self.trial_running = True
+        return True
+
+    def abandon_trial(self):
+        """Let another call be the trial, when the trial call was cancelled."""
+        self.trial_running = False
+
+    def record_success(self):
+        if self.is_open:
+            logger.info(f"Plugin {self.plugin_name} recovered, no longer bypassed")
+            plugin_circuit_open.labels(self.plugin_name).set(0)
+        self.failures = 0
+        self.trips = 0
+        self.open_until = None
+        self.trial_running = False
+
+    def record_failure(self):
+        self.failures += 1
+        self.trial_running = False
+        if self.is_open or self.failures >= self.failure_threshold:
+            delay = min(self.max_retry_after, self.retry_after * 2**self.trips)
+            self.trips += 1
+            self.open_until = time.monotonic() + delay
+            plugin_circuit_open.labels(self.plugin_name).set(1)
+            logger.warning(
+                f"Plugin {self.plugin_name} failed {self.failures} times in a row, bypassing it for {delay}s"
+            )
+
+
+circuit_breakers = {}
+
+
+def get_circuit_breaker(plugin):
+    if plugin.plugin_name not in circuit_breakers:
+        circuit_breakers[plugin.plugin_name] = CircuitBreaker(
+            plugin.plugin_name,
+            failure_threshold=plugin.config.get("failure_threshold", 3),
+            retry_after=plugin.config.get("retry_after", 30),
+        )
+    return circuit_breakers[plugin.plugin_name]
+
+
+def discover_custom_plugins(plugins_dir=custom_plugins_dir):
+    """
+    Find custom plugins, registered under their file name without the `.py` extension.
+
+    :param plugins_dir: The directory to search for custom plugins.
+    :return: A dict of plugin names to plugin file paths.
+    """
+    custom_plugins = {}
+    if not os.path.isdir(plugins_dir):
+        return custom_plugins
 
+    for filename in sorted(os.listdir(plugins_dir)):
+        if filename.endswith(".py") and not filename.startswith("_"):
+            plugin_name = filename[:-3]
+            if plugin_name in plugin_registry:
+                logger.warning(
+                    f"Custom plugin {filename} conflicts with a built-in plugin, skipping"
+                )
+                continue
+            custom_plugins[plugin_name] = os.path.join(plugins_dir, filename)
+    return custom_plugins
 
-def load_plugins():
-    from plugins.health_plugin import Plugin as HealthPlugin
-    from plugins.map_plugin import Plugin as MapPlugin
-    from plugins.mesh_relay_plugin import Plugin as MeshRelayPlugin
-    from plugins.ping_plugin import Plugin as PingPlugin
-    from plugins.telemetry_plugin import Plugin as TelemetryPlugin
-    from plugins.weather_plugin import Plugin as WeatherPlugin
-    from plugins.help_plugin import Plugin as HelpPlugin
-    from plugins.nodes_plugin import Plugin as NodesPlugin
-    from plugins.drop_plugin import Plugin as DropPlugin
-    from plugins.debug_plugin import Plugin as DebugPlugin
-    from plugins.chutilz_plugin import Plugin as ChutilzPlugin
-    from plugins.airutilz_plugin import Plugin as AirutilzPlugin
-    from plugins.voltage_plugin import Plugin as VoltagePlugin
-    from plugins.battery_plugin import Plugin as BatteryPlugin
-    from plugins.snr_plugin import Plugin as SNRPlugin
 
+def is_plugin_active(plugin_name):
+    plugins_config = relay_config.get("plugins") or {}
+    plugin_config = plugins_config.get(plugin_name) or {}
+    return bool(plugin_config.get("active", False))
 
+
+def import_plugin_module(plugin_name, location, reload_module=False):
+    if location.endswith(".py"):
+        spec = importlib.util.spec_from_file_location(
+            f"custom_plugins.{plugin_name}", location
+        )
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        return module
+    if reload_module and location in sys.modules:
+        return importlib.reload(sys.modules[location])
+    return importlib.import_module(location)
+
+
+async def run_plugin_handler(plugin, handler, *args, **kwargs):
+    """
+    Call a plugin message handler within its timeout and record how long it took.
+
+    A handler that times out or raises counts towards the plugin's circuit
+    breaker, and a plugin whose breaker is open is skipped.
+
+    :param handler: `handle_meshtastic_message` or `handle_room_message`.
+    :return: The handler result, True when the plugin consumed the message.
+    """
+    breaker = get_circuit_breaker(plugin)
+    if not breaker.allow():
+        return False
+
+    timeout = plugin.config.get("timeout", plugin.handler_timeout)
+    start_time = time.perf_counter()
+    try:
+        result = await asyncio.wait_for(
+            getattr(plugin, handler)(*args, **kwargs), timeout=timeout
+        )
+        breaker.record_success()
+        return result
+    except asyncio.TimeoutError:
+        plugin.logger.error(f"{handler} timed out after {timeout}s")
+        plugin_failures.labels(plugin.plugin_name, handler, "timeout").inc()
+        breaker.record_failure()
+        return False
+    except Exception as e:
+        plugin.logger.error(f"Error in {handler}: {e}")
+        plugin_failures.labels(plugin.plugin_name, handler, "error").inc()
+        breaker.record_failure()
+        return False
+    except asyncio.CancelledError:
+        breaker.abandon_trial()
+        raise
+    finally:
+        duration = time.perf_counter() - start_time
+        plugin_handler_duration.labels(plugin.plugin_name, handler).observe(duration)
+
+        budget_ms = plugin.config.get("latency_budget_ms", plugin.latency_budget_ms)
+        slow = duration * 1000 > budget_ms
+        if slow:
+            plugin.logger.warning(
+                "%s took %.0f ms, over its %s ms budget", handler, duration * 1000, budget_ms
+            )
+        key = (plugin.plugin_name, handler)
+        if key not in plugin_latencies:
+            plugin_latencies[key] = LatencyWindow()
+        plugin_latencies[key].add(duration, slow=slow)
+
+
+def get_plugin_latency_stats():
+    return {key: window.summary() for key, window in plugin_latencies.items()}
+
+
+def unload_plugins():
+    """Stop the loaded plugins, so the next `load_plugins` builds them from the current config."""
     global sorted_active_plugins
-    if sorted_active_plugins:
-        return sorted_active_plugins
+    global plugins_loaded
+    for plugin in sorted_active_plugins:
+        try:
+            plugin.stop()
+        except Exception as e:
+            logger.error(f"Error stopping plugin {plugin.plugin_name}: {e}")
+    for plugin_name in circuit_breakers:
+        plugin_circuit_open.labels(plugin_name).set(0)
+    circuit_breakers.clear()
+    sorted_active_plugins = []
+    plugins_loaded = False
 
-    plugins = [
-        HealthPlugin(),
-        MapPlugin(),
-        MeshRelayPlugin(),
-        PingPlugin(),
-        TelemetryPlugin(),
-        WeatherPlugin(),
-        HelpPlugin(),
-        NodesPlugin(),
-        DropPlugin(),
-        DebugPlugin(),
-        ChutilzPlugin(),
-        AirutilzPlugin(),
-        VoltagePlugin(),
-        BatteryPlugin(),
-        SNRPlugin(),
 
+def load_plugins(reload_modules=False):
+    """
+    Import and start the active plugins once, returning them sorted by priority.
 
+    :param reload_modules: Re-import built-in plugin modules already imported,
+        to pick up changed source. Custom plugins are always read from their file.
+    """
+    global sorted_active_plugins
+    global plugins_loaded
+    if plugins_loaded:
+        return sorted_active_plugins
 
-    ]
+    start_time = time.monotonic()
+    registry = dict(plugin_registry)
+    registry.update(discover_custom_plugins())
 
     active_plugins = []
-    for plugin in plugins:
-        if plugin.config["active"]:
-            plugin.priority = (
-                plugin.config["priority"]
-                if "priority" in plugin.config
-                else plugin.priority
+    for plugin_name, location in registry.items():
+        if not is_plugin_active(plugin_name):
+            continue
+
+        try:
+            if relay_config["plugins"][plugin_name].get("isolation") == "process":
+                from plugin_worker import WorkerPlugin
+
+                plugin = WorkerPlugin(plugin_name, location)
+            else:
+                module = import_plugin_module(plugin_name, location, reload_modules)
+                plugin = module.Plugin()
+        except Exception as e:
+            logger.error(f"Error loading plugin {plugin_name}: {e}")
+            continue
+
+        if plugin.plugin_name != plugin_name:
+            logger.warning(
+                f"Plugin {location} is named {plugin.plugin_name}, expected {plugin_name}"
             )
-            active_plugins.append(plugin)
+
+        plugin.priority = (
+            plugin.config["priority"]
+            if "priority" in plugin.config
+            else plugin.priority
+        )
+        try:
             plugin.start()
+        except Exception as e:
+            logger.error(f"Error starting plugin {plugin_name}: {e}")
+            continue
+        active_plugins.append(plugin)
 
     sorted_active_plugins = sorted(active_plugins, key=lambda plugin: plugin.priority)
+    plugins_loaded = True
+    logger.debug(
+        f"Loaded {len(sorted_active_plugins)} plugins in {time.monotonic() - start_time:.2f}s"
+    )
     return sorted_active_plugins
-
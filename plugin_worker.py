@@ -0,0 +1,442 @@
+import asyncio
+import concurrent.futures
+import contextvars
+import itertools
+import multiprocessing
+import os
+import threading
+import time
+from types import SimpleNamespace
+from metrics_utils import plugin_worker_restarts
+from plugins.base_plugin import BasePlugin
+
+# BasePlugin methods an isolated plugin calls back into the relay for
+rpc_methods = {
+    "send_matrix_message": True,
+    "send_mesh_message": True,
+    "get_mesh_nodes": False,
+    "append_node_data": False,
+    "set_node_data": False,
+    "delete_node_data": False,
+    "get_node_data": False,
+    "get_nodes_data": False,
+}
+
+# db_utils functions plugins import directly. In a worker they are run by the
+# relay, so the relay's writer thread stays the only writer of the database.
+db_functions = (
+    "record_telemetry_rollups",
+    "get_telemetry_rollups",
+    "compact_telemetry",
+    "get_message_history",
+    "search_message_history",
+    "expire_message_history",
+)
+
+# Radio the handler call being run in the worker belongs to
+call_interface = contextvars.ContextVar("call_interface", default=None)
+
+
+def without_raw(value):
+    """Copy a packet without the protobuf `raw` entries, which do not pickle reliably."""
+    if isinstance(value, dict):
+        return {key: without_raw(item) for key, item in value.items() if key != "raw"}
+    if isinstance(value, list):
+        return [without_raw(item) for item in value]
+    return value
+
+
+def snapshot_room(room):
+    return SimpleNamespace(
+        room_id=room.room_id, display_name=getattr(room, "display_name", None)
+    )
+
+
+def snapshot_event(event):
+    return SimpleNamespace(
+        sender=event.sender,
+        body=getattr(event, "body", None),
+        event_id=getattr(event, "event_id", None),
+        server_timestamp=getattr(event, "server_timestamp", None),
+        source=getattr(event, "source", {}),
+    )
+
+
+class Channel:
+    """A pipe end that can be written from several threads."""
+
+    def __init__(self, conn):
+        self.conn = conn
+        self._lock = threading.Lock()
+
+    def send(self, message):
+        with self._lock:
+            self.conn.send(message)
+
+    def recv(self):
+        return self.conn.recv()
+
+
+class WorkerPlugin(BasePlugin):
+    """
+    Relay-side proxy of a plugin running in a supervised worker process.
+
+    Enabled with `isolation: process` in the plugin's config. Packets and room
+    events are passed to the worker over a pipe, and the worker calls back for
+    the BasePlugin APIs that need the relay: sending messages, the mesh nodes and
+    plugin node data. A worker that exits is restarted with exponential backoff;
+    messages arriving meanwhile are not handled by the plugin.
+    """
+
+    restart_backoff_cap = 60
+    # A worker that ran this long before exiting restarts without delay
+    stable_seconds = 60
+
+    def __init__(self, plugin_name, location):
+        self.plugin_name = plugin_name
+        self.location = location
+        super().__init__()
+        self.matrix_commands = [plugin_name]
+        self.mesh_commands = []
+        self._description = ""
+        self.loop = None
+        self.process = None
+        self.channel = None
+        self.ready = False
+        self.started_at = None
+        self.restart_attempt = 0
+        self.stopping = False
+        self._call_ids = itertools.count()
+        self._pending = {}
+
+    @property
+    def description(self):
+        return self._description
+
+    def get_matrix_commands(self):
+        return self.matrix_commands
+
+    def get_mesh_commands(self):
+        return self.mesh_commands
+
+    def start(self):
+        # Schedules are run by the plugin inside the worker
+        try:
+            self.loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self.loop = asyncio.get_event_loop()
+        self.spawn()
+
+    def spawn(self):
+        import matrix_utils
+
+        context = multiprocessing.get_context("spawn")
+        parent_conn, child_conn = context.Pipe()
+        self.channel = Channel(parent_conn)
+        self.process = context.Process(
+            target=worker_main,
+            args=(
+                child_conn,
+                self.plugin_name,
+                self.location,
+                matrix_utils.bot_user_name,
+            ),
+            name=f"plugin-{self.plugin_name}",
+            daemon=True,
+        )
+        self.process.start()
+        child_conn.close()
+        self.started_at = time.monotonic()
+        threading.Thread(
+            target=self._read,
+            args=(self.channel, self.process),
+            name=f"plugin-{self.plugin_name}-reader",
+            daemon=True,
+        ).start()
+        self.logger.info(f"Started worker process {self.process.pid}")
+
+    def stop(self):
+        self.stopping = True
+        self.ready = False
+        if self.process and self.process.is_alive():
+            try:
+                self.channel.send({"type": "stop"})
+            except Exception:
+                pass
+            # Kill a worker that does not exit in time, without blocking the caller
+            timer = threading.Timer(5, self._terminate, args=(self.process,))
+            timer.daemon = True
+            timer.start()
+
+    def _terminate(self, process):
+        if process.is_alive():
+            process.terminate()
+
+    def _read(self, channel, process):
+        # Runs on a reader thread, handing messages to the event loop
+        while True:
+            try:
+                message = channel.recv()
+            except (EOFError, OSError):
+                break
+            self.loop.call_soon_threadsafe(self._dispatch, channel, message)
+        process.join(timeout=5)
+        try:
+            self.loop.call_soon_threadsafe(self._on_exit, process)
+        except RuntimeError:
+            # The event loop is closed, the relay is shutting down
+            pass
+
+    def _dispatch(self, channel, message):
+        if message["type"] == "ready":
+            self.ready = True
+            self.matrix_commands = message["matrix_commands"]
+            self.mesh_commands = message["mesh_commands"]
+            self._description = message["description"]
+            # Node data RPCs run on this proxy, so they need the plugin's cap
+            self.max_data_rows_per_node = message["max_data_rows_per_node"]
+            self.logger.debug("Worker is ready")
+        elif message["type"] == "result":
+            future = self._pending.pop(message["id"], None)
+            if future and not future.done():
+                if message.get("error"):
+                    future.set_exception(RuntimeError(message["error"]))
+                else:
+                    future.set_result(message.get("value"))
+        elif message["type"] == "rpc":
+            self.loop.create_task(self._serve_rpc(channel, message))
+
+    async def _serve_rpc(self, channel, message):
+        from meshtastic_utils import current_interface
+
+        reply = {"type": "rpc_result", "id": message["id"]}
+        try:
+            method = message["method"]
+            if method == "db":
+                import db_utils
+
+                name, *args = message["args"]
+                if name not in db_functions:
+                    raise ValueError(f"{name} is not available to plugin workers")
+                result = getattr(db_utils, name)(*args, **message["kwargs"])
+            elif method not in rpc_methods:
+                raise ValueError(f"{method} is not available to plugin workers")
+            else:
+                current_interface.set(message.get("interface"))
+                result = getattr(BasePlugin, method)(
+                    self, *message["args"], **message["kwargs"]
+                )
+                if rpc_methods[method]:
+                    result = await result
+            if method in ("send_matrix_message", "send_mesh_message"):
+                # Client responses do not pickle, the worker only needs success
+                result = getattr(result, "event_id", None) if result else None
+            reply["value"] = result
+        except Exception as e:
+            reply["error"] = f"{type(e).__name__}: {e}"
+        try:
+            channel.send(reply)
+        except Exception as e:
+            self.logger.debug("Error replying to worker: %s", e)
+
+    def _on_exit(self, process):
+        if process is not self.process:
+            return
+        self.ready = False
+        for future in self._pending.values():
+            if not future.done():
+                future.set_exception(ConnectionError("Plugin worker exited"))
+        self._pending.clear()
+        if self.stopping:
+            return
+
+        if time.monotonic() - self.started_at > self.stable_seconds:
+            self.restart_attempt = 0
+        delay = min(self.restart_backoff_cap, 2**self.restart_attempt)
+        self.restart_attempt += 1
+        plugin_worker_restarts.labels(self.plugin_name).inc()
+        self.logger.error(
+            f"Worker exited with code {process.exitcode}, restarting in {delay}s"
+        )
+        self.loop.call_later(delay, self.spawn)
+
+    async def call(self, handler, *args):
+        if not self.ready:
+            self.logger.debug("Worker is not running, skipping %s", handler)
+            return False
+
+        import matrix_utils
+        from meshtastic_utils import current_interface
+
+        call_id = next(self._call_ids)
+        future = self.loop.create_future()
+        self._pending[call_id] = future
+        try:
+            self.channel.send(
+                {
+                    "type": "call",
+                    "id": call_id,
+                    "handler": handler,
+                    "args": args,
+                    "interface": current_interface.get(),
+                    "bot_user_name": matrix_utils.bot_user_name,
+                }
+            )
+            return await future
+        finally:
+            self._pending.pop(call_id, None)
+
+    async def handle_meshtastic_message(
+        self, packet, formatted_message, longname, meshnet_name
+    ):
+        return await self.call(
+            "handle_meshtastic_message",
+            without_raw(packet),
+            formatted_message,
+            longname,
+            meshnet_name,
+        )
+
+    async def handle_room_message(self, room, event, full_message):
+        return await self.call(
+            "handle_room_message",
+            snapshot_room(room),
+            snapshot_event(event),
+            full_message,
+        )
+
+
+class WorkerHost:
+    """Runs a plugin inside the worker process and relays its calls to the parent."""
+
+    def __init__(self, conn, plugin_name, location, bot_user_name=None):
+        self.channel = Channel(conn)
+        self.plugin_name = plugin_name
+        self.location = location
+        self.bot_user_name = bot_user_name
+        self.loop = None
+        self.plugin = None
+        self._rpc_ids = itertools.count()
+        self._rpc_pending = {}
+
+    def rpc(self, method, *args, **kwargs):
+        """Call a BasePlugin method in the relay. Safe to call from any thread."""
+        rpc_id = next(self._rpc_ids)
+        future = concurrent.futures.Future()
+        self._rpc_pending[rpc_id] = future
+        self.channel.send(
+            {
+                "type": "rpc",
+                "id": rpc_id,
+                "method": method,
+                "args": args,
+                "kwargs": kwargs,
+                "interface": call_interface.get(),
+            }
+        )
+        return future
+
+    def install_rpc(self, plugin):
+        for method, is_async in rpc_methods.items():
+            if is_async:
+
+                async def call(*args, _method=method, **kwargs):
+                    return await asyncio.wrap_future(self.rpc(_method, *args, **kwargs))
+
+            else:
+
+                def call(*args, _method=method, **kwargs):
+                    return self.rpc(_method, *args, **kwargs).result()
+
+            setattr(plugin, method, call)
+        # store_node_data appends through the instance attribute
+        plugin.store_node_data = plugin.append_node_data
+
+    def install_db_rpc(self):
+        # Before the plugin is imported, so its `from db_utils import` gets these
+        import db_utils
+
+        for name in db_functions:
+
+            def call(*args, _name=name, **kwargs):
+                return self.rpc("db", _name, *args, **kwargs).result()
+
+            setattr(db_utils, name, call)
+
+    def set_bot_user_name(self, bot_user_name):
+        # The relay logs in to Matrix, bot_command() needs the name it detected
+        import matrix_utils
+
+        if bot_user_name:
+            matrix_utils.bot_user_name = bot_user_name
+
+    async def run(self):
+        from plugin_loader import import_plugin_module
+        from scheduler_utils import scheduler
+
+        self.loop = asyncio.get_running_loop()
+        self.set_bot_user_name(self.bot_user_name)
+        self.install_db_rpc()
+        self.plugin = import_plugin_module(self.plugin_name, self.location).Plugin()
+        self.install_rpc(self.plugin)
+        scheduler.start()
+        self.plugin.start()
+
+        description = self.plugin.description
+        if callable(description):
+            description = description()
+        self.channel.send(
+            {
+                "type": "ready",
+                "description": description,
+                "matrix_commands": self.plugin.get_matrix_commands(),
+                "mesh_commands": self.plugin.get_mesh_commands(),
+                "max_data_rows_per_node": self.plugin.max_data_rows_per_node,
+            }
+        )
+
+        stopped = self.loop.create_future()
+        threading.Thread(target=self._read, args=(stopped,), daemon=True).start()
+        await stopped
+
+    def _read(self, stopped):
+        while True:
+            try:
+                message = self.channel.recv()
+            except (EOFError, OSError):
+                # The relay is gone
+                os._exit(0)
+
+            if message["type"] == "rpc_result":
+                future = self._rpc_pending.pop(message["id"], None)
+                if future is None:
+                    continue
+                if "error" in message:
+                    future.set_exception(RuntimeError(message["error"]))
+                else:
+                    future.set_result(message.get("value"))
+            elif message["type"] == "call":
+                self.loop.call_soon_threadsafe(self._start_call, message)
+            elif message["type"] == "stop":
+                self.loop.call_soon_threadsafe(stopped.set_result, None)
+                return
+
+    def _start_call(self, message):
+        self.set_bot_user_name(message.get("bot_user_name"))
+        call_interface.set(message.get("interface"))
+        self.loop.create_task(self._handle_call(message))
+
+    async def _handle_call(self, message):
+        reply = {"type": "result", "id": message["id"]}
+        try:
+            reply["value"] = bool(
+                await getattr(self.plugin, message["handler"])(*message["args"])
+            )
+        except Exception as e:
+            self.plugin.logger.error(f"Error in {message['handler']}: {e}")
+            reply["error"] = f"{type(e).__name__}: {e}"
+        self.channel.send(reply)
+
+
+def worker_main(conn, plugin_name, location, bot_user_name=None):
+    asyncio.run(WorkerHost(conn, plugin_name, location, bot_user_name).run())
@@ -1,15 +1,15 @@
+import json
 import markdown
-import schedule
-import threading
-import time
 from abc import ABC, abstractmethod
 from log_utils import get_logger
 from config import relay_config
+from scheduler_utils import scheduler
 from db_utils import (
-    store_plugin_data,
-    get_plugin_data,
-    get_plugin_data_for_node,
-    delete_plugin_data,
+    append_plugin_node_rows,
+    set_plugin_node_rows,
+    get_plugin_node_rows,
+    get_plugin_rows,
+    delete_plugin_node_rows,
 )
 
 
@@ -17,6 +17,10 @@ class BasePlugin(ABC):
     plugin_name = None
     max_data_rows_per_node = 100
     priority = 10
+    # Handlers slower than this are logged, override with latency_budget_ms in config
+    latency_budget_ms = 500
+    # Handlers are cancelled after this many seconds, override with timeout in config
+    handler_timeout = 30
 
     @property
     def description(self):
@@ -38,37 +42,20 @@ class BasePlugin(ABC):
             self.logger.debug(f"Started with priority={self.priority}")
             return
 
-        # Schedule the email-checking function to run every minute
-        if "at" in self.config["schedule"] and "hours" in self.config["schedule"]:
-            schedule.every(self.config["schedule"]["hours"]).hours.at(
-                self.config["schedule"]["at"]
-            ).do(self.background_job)
-        elif "at" in self.config["schedule"] and "minutes" in self.config["schedule"]:
-            schedule.every(self.config["schedule"]["minutes"]).minutes.at(
-                self.config["schedule"]["at"]
-            ).do(self.background_job)
-        elif "hours" in self.config["schedule"]:
-            schedule.every(self.config["schedule"]["hours"]).hours.do(
-                self.background_job
-            )
-        elif "minutes" in self.config["schedule"]:
-            schedule.every(self.config["schedule"]["minutes"]).minutes.do(
-                self.background_job
-            )
-
-        # Function to execute the scheduled tasks
-        def run_schedule():
-            while True:
-                schedule.run_pending()
-                time.sleep(1)
-
-        # Create a thread for executing the scheduled tasks
-        schedule_thread = threading.Thread(target=run_schedule)
-
-        # Start the thread
-        schedule_thread.start()
+        # Run background_job on the relay's shared scheduler
+        scheduler.add_job(
+            self.plugin_name,
+            self.background_job,
+            hours=self.config["schedule"].get("hours"),
+            minutes=self.config["schedule"].get("minutes"),
+            at=self.config["schedule"].get("at"),
+            jitter=self.config["schedule"].get("jitter", 0),
+        )
         self.logger.debug(f"Scheduled with priority={self.priority}")
 
+    def stop(self):
+        scheduler.remove_job(self.plugin_name)
+
     def background_job(self):
         pass
 
@@ -103,30 +90,53 @@ class BasePlugin(ABC):
             },
         )
 
+    async def send_mesh_message(self, text, destinationId="^all", channelIndex=0):
+        from meshtastic_utils import get_transport
+
+        return await get_transport().send_text(
+            text=text, destinationId=destinationId, channelIndex=channelIndex
+        )
+
+    def get_mesh_nodes(self):
+        from meshtastic_utils import get_nodes
+
+        return get_nodes()
+
     def get_mesh_commands(self):
         return []
 
+    def append_node_data(self, meshtastic_id, node_data):
+        """
+        Append a row, or a list of rows, to the data of a node.
+
+        Rows beyond `max_data_rows_per_node` are dropped oldest first. Appends are
+        applied in order by the database writer, so concurrent appends are never lost.
+        """
+        rows = node_data if type(node_data) is list else [node_data]
+        append_plugin_node_rows(
+            self.plugin_name, meshtastic_id, rows, self.max_data_rows_per_node
+        )
+
     def store_node_data(self, meshtastic_id, node_data):
-        data = self.get_node_data(meshtastic_id=meshtastic_id)
-        data = data[-self.max_data_rows_per_node :]
-        if type(node_data) is list:
-            data.extend(node_data)
-        else:
-            data.append(node_data)
-        store_plugin_data(self.plugin_name, meshtastic_id, data)
+        self.append_node_data(meshtastic_id, node_data)
 
     def set_node_data(self, meshtastic_id, node_data):
         node_data = node_data[-self.max_data_rows_per_node :]
-        store_plugin_data(self.plugin_name, meshtastic_id, node_data)
+        set_plugin_node_rows(self.plugin_name, meshtastic_id, node_data)
 
     def delete_node_data(self, meshtastic_id):
-        return delete_plugin_data(self.plugin_name, meshtastic_id)
+        return delete_plugin_node_rows(self.plugin_name, meshtastic_id)
 
     def get_node_data(self, meshtastic_id):
-        return get_plugin_data_for_node(self.plugin_name, meshtastic_id)
+        return get_plugin_node_rows(self.plugin_name, meshtastic_id)
+
+    def get_nodes_data(self):
+        """Return the data rows of every node, keyed by Meshtastic ID."""
+        return get_plugin_rows(self.plugin_name)
 
     def get_data(self):
-        return get_plugin_data(self.plugin_name)
+        # Rows shaped like the old plugin_data table: one JSON list per node
+        return [(json.dumps(rows),) for rows in self.get_nodes_data().values()]
 
     def matches(self, payload):
         from matrix_utils import bot_command
@@ -1,3 +1,5 @@
+import logging
+
 from plugins.base_plugin import BasePlugin
 
 
@@ -8,9 +10,10 @@ class Plugin(BasePlugin):
     async def handle_meshtastic_message(
         self, packet, formatted_message, longname, meshnet_name
     ):
-        packet = self.strip_raw(packet)
-
-        self.logger.debug(f"Packet received: {packet}")
+        # Skip the packet walk entirely unless debug output is enabled
+        if self.logger.isEnabledFor(logging.DEBUG):
+            packet = self.strip_raw(packet)
+            self.logger.debug("Packet received: %s", packet)
         return False
 
     async def handle_room_message(self, room, event, full_message):
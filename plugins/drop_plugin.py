@@ -1,7 +1,7 @@
 import re
 from haversine import haversine
 from plugins.base_plugin import BasePlugin
-from meshtastic_utils import connect_meshtastic
+from meshtastic_utils import get_my_node_id, get_nodes, get_transport
 from meshtastic import mesh_pb2
 
 
@@ -9,28 +9,27 @@ class Plugin(BasePlugin):
     plugin_name = "drop"
     special_node = "!NODE_MSGS!"
 
-    def get_position(self, meshtastic_client, node_id):
-        for node, info in meshtastic_client.nodes.items():
-            if info["user"]["id"] == node_id:
+    def get_position(self, nodes, node_id):
+        for node, info in nodes.items():
+            if "user" in info and info["user"]["id"] == node_id:
                 return info["position"]
         return None
 
     async def handle_meshtastic_message(
         self, packet, formatted_message, longname, meshnet_name
     ):
-        meshtastic_client = connect_meshtastic()
-        nodeInfo = meshtastic_client.getMyNodeInfo()
+        nodes = get_nodes()
 
         # Attempt message drop to packet originator if not relay
-        if "fromId" in packet and packet["fromId"] != nodeInfo["user"]["id"]:
-            position = self.get_position(meshtastic_client, packet["fromId"])
+        if "fromId" in packet and packet["fromId"] != get_my_node_id():
+            position = self.get_position(nodes, packet["fromId"])
             if position and "latitude" in position and "longitude" in position:
                 packet_location = (
                     position["latitude"],
                     position["longitude"],
                 )
 
-                self.logger.debug(f"Packet originates from: {packet_location}")
+                self.logger.debug("Packet originates from: %s", packet_location)
                 messages = self.get_node_data(self.special_node)
                 unsent_messages = []
                 for message in messages:
@@ -54,8 +53,8 @@ class Plugin(BasePlugin):
                     )
                     if distance_km <= radius_km:
                         target_node = packet["fromId"]
-                        self.logger.debug(f"Sending dropped message to {target_node}")
-                        meshtastic_client.sendText(
+                        self.logger.debug("Sending dropped message to %s", target_node)
+                        await get_transport().send_text(
                             text=message["text"], destinationId=target_node
                         )
                     else:
@@ -63,7 +62,7 @@ class Plugin(BasePlugin):
                 self.set_node_data(self.special_node, unsent_messages)
                 total_unsent_messages = len(unsent_messages)
                 if total_unsent_messages > 0:
-                    self.logger.debug(f"{total_unsent_messages} message(s) remaining")
+                    self.logger.debug("%d message(s) remaining", total_unsent_messages)
 
         # Attempt to drop a message
         if (
@@ -82,8 +81,8 @@ class Plugin(BasePlugin):
             drop_message = match.group(1)
 
             position = {}
-            for node, info in meshtastic_client.nodes.items():
-                if info["user"]["id"] == packet["fromId"]:
+            for node, info in nodes.items():
+                if "user" in info and info["user"]["id"] == packet["fromId"]:
                     position = info["position"]
 
             if "latitude" not in position or "longitude" not in position:
@@ -92,7 +91,7 @@ class Plugin(BasePlugin):
                 )
                 return True
 
-            self.store_node_data(
+            self.append_node_data(
                 self.special_node,
                 {
                     "location": (position["latitude"], position["longitude"]),
@@ -100,7 +99,7 @@ class Plugin(BasePlugin):
                     "originator": packet["fromId"],
                 },
             )
-            self.logger.debug(f"Dropped a message: {drop_message}")
+            self.logger.debug("Dropped a message: %s", drop_message)
             return True
 
     async def handle_room_message(self, room, event, full_message):
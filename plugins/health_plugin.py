@@ -11,14 +11,14 @@ class Plugin(BasePlugin):
         return "Show mesh health using avg battery, SNR, AirUtil"
 
     def generate_response(self):
-        from meshtastic_utils import connect_meshtastic
+        from meshtastic_utils import get_nodes
 
-        meshtastic_client = connect_meshtastic()
+        nodes = get_nodes()
         battery_levels = []
         air_util_tx = []
         snr = []
 
-        for node, info in meshtastic_client.nodes.items():
+        for node, info in nodes.items():
             if "deviceMetrics" in info:
                 if "batteryLevel" in info["deviceMetrics"]:
                     battery_levels.append(info["deviceMetrics"]["batteryLevel"])
@@ -28,7 +28,7 @@ class Plugin(BasePlugin):
                 snr.append(info["snr"])
 
         low_battery = len([n for n in battery_levels if n <= 10])
-        radios = len(meshtastic_client.nodes)
+        radios = len(nodes)
         avg_battery = statistics.mean(battery_levels) if battery_levels else 0
         mdn_battery = statistics.median(battery_levels)
         avg_air = statistics.mean(air_util_tx) if air_util_tx else 0
@@ -0,0 +1,97 @@
+import re
+import time
+from datetime import datetime
+from plugins.base_plugin import BasePlugin
+from scheduler_utils import scheduler
+from db_utils import (
+    expire_message_history,
+    get_message_history,
+    search_message_history,
+)
+
+
+class Plugin(BasePlugin):
+    plugin_name = "history"
+
+    @property
+    def description(self):
+        return (
+            "Relayed message history. `!history [sender] [p2]` shows the latest "
+            "messages, optionally of a node ID or name, and `!search <words> [p2]` "
+            "searches them"
+        )
+
+    def start(self):
+        super().start()
+        scheduler.add_job(
+            f"{self.plugin_name}_retention", self.expire, hours=24, jitter=300
+        )
+
+    def stop(self):
+        super().stop()
+        scheduler.remove_job(f"{self.plugin_name}_retention")
+
+    def expire(self):
+        retention_days = self.config.get("retention_days", 30)
+        expire_message_history(time.time() - retention_days * 86400)
+
+    def get_matrix_commands(self):
+        return ["history", "search"]
+
+    def matches(self, payload):
+        from matrix_utils import bot_command
+
+        if type(payload) == str:
+            return any(bot_command(command, payload) for command in self.get_matrix_commands())
+        return False
+
+    def format_messages(self, messages, page, empty_response):
+        if not messages:
+            return empty_response if page == 1 else f"No more messages (page {page})"
+
+        lines = [f"Page {page}:"]
+        for timestamp, direction, sender, text in messages:
+            source = "mesh" if direction == "mesh_to_matrix" else "matrix"
+            when = datetime.fromtimestamp(timestamp).strftime("%m-%d %H:%M")
+            lines.append(f"{when} [{source}] {sender}: {text}")
+        return "\n".join(lines)
+
+    def generate_response(self, command, args):
+        page = 1
+        # A trailing "p<N>" selects the page
+        if args and re.fullmatch(r"p\d+", args[-1]):
+            page = max(1, int(args.pop()[1:]))
+        page_size = self.config.get("page_size", 10)
+        offset = (page - 1) * page_size
+
+        if command == "search":
+            if not args:
+                return "Usage: !search <words> [p2]"
+            messages = search_message_history(" ".join(args), page_size, offset)
+            return self.format_messages(messages, page, "No matching messages")
+
+        sender = " ".join(args) or None
+        messages = get_message_history(sender, page_size, offset)
+        return self.format_messages(messages, page, "No messages relayed yet")
+
+    async def handle_meshtastic_message(
+        self, packet, formatted_message, longname, meshnet_name
+    ):
+        return False
+
+    async def handle_room_message(self, room, event, full_message):
+        full_message = full_message.strip()
+        if not self.matches(full_message):
+            return False
+
+        match = re.search(r":\s+!(history|search)(?:\s+(.+))?$", full_message)
+        if not match:
+            return False
+
+        args = (match.group(2) or "").split()
+        await self.send_matrix_message(
+            room.room_id,
+            self.generate_response(match.group(1), args),
+            formatted=False,
+        )
+        return True
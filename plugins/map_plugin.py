@@ -240,10 +240,9 @@ class Plugin(BasePlugin):
             return False
 
         from matrix_utils import connect_matrix
-        from meshtastic_utils import connect_meshtastic
+        from meshtastic_utils import get_nodes
 
         matrix_client = await connect_matrix()
-        meshtastic_client = connect_meshtastic()
 
         pattern = r"^.*:(?: !map(?: zoom=(\d+))?(?: size=(\d+),(\d+))?)?$"
         match = re.match(pattern, full_message)
@@ -275,8 +274,12 @@ class Plugin(BasePlugin):
             image_size = (1000, 1000)
 
         locations = []
-        for node, info in meshtastic_client.nodes.items():
-            if "position" in info and "latitude" in info["position"]:
+        for node, info in get_nodes().items():
+            if (
+                "user" in info
+                and "position" in info
+                and "latitude" in info["position"]
+            ):
                 locations.append(
                     {
                         "lat": info["position"]["latitude"],
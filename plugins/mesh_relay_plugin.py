@@ -3,11 +3,15 @@ import io
 import re
 import base64
 import json
+import time
+from collections import Counter
 from typing import List
 from meshtastic import mesh_pb2
 
 from plugins.base_plugin import BasePlugin
 from config import relay_config
+from dedup_utils import dedup_cache
+from metrics_utils import mesh_relay_packets
 
 matrix_rooms: List[dict] = relay_config["matrix_rooms"]
 
@@ -16,6 +20,61 @@ class Plugin(BasePlugin):
     plugin_name = "mesh_relay"
     max_data_rows_per_node = 50
 
+    def __init__(self) -> None:
+        super().__init__()
+        self.allowed_portnums = self.config.get("portnums")
+        self.denied_portnums = self.config.get("exclude_portnums", [])
+        # Minimum seconds between forwarded packets per node and portnum
+        self.rate_limits = self.config.get("rate_limits", {})
+        self.last_forwarded = {}
+        self.forwarded = Counter()
+        self.suppressed = Counter()
+
+    def should_forward(self, packet):
+        """
+        Apply the portnum allow/deny lists and per-node rate limits.
+
+        :param packet: The decoded packet received from the radio.
+        :return: True if the packet should be forwarded to Matrix.
+        """
+        portnum = packet.get("decoded", {}).get("portnum")
+
+        if self.allowed_portnums is not None and portnum not in self.allowed_portnums:
+            self.count(portnum, forwarded=False)
+            return False
+
+        if portnum in self.denied_portnums:
+            self.count(portnum, forwarded=False)
+            return False
+
+        interval = self.rate_limits.get(portnum)
+        if interval:
+            key = (packet.get("fromId"), portnum)
+            now = time.monotonic()
+            last = self.last_forwarded.get(key)
+            if last is not None and now - last < interval:
+                self.count(portnum, forwarded=False)
+                return False
+            self.last_forwarded[key] = now
+
+        self.count(portnum, forwarded=True)
+        return True
+
+    def count(self, portnum, forwarded):
+        if forwarded:
+            self.forwarded[portnum] += 1
+        else:
+            self.suppressed[portnum] += 1
+        mesh_relay_packets.labels(
+            portnum, "forwarded" if forwarded else "suppressed"
+        ).inc()
+
+    def get_counters(self):
+        return {
+            "forwarded": dict(self.forwarded),
+            "suppressed": dict(self.suppressed),
+        }
+
     def normalize(self, dict_obj):
         """
         Packets are either a dict, string dict or string
@@ -50,26 +109,36 @@ class Plugin(BasePlugin):
         self, packet, formatted_message, longname, meshnet_name
     ):
         from matrix_utils import connect_matrix
+        from meshtastic_utils import get_radio, get_room_interface
 
-        packet = self.process(packet)
-        matrix_client = await connect_matrix()
-
-        packet_type = packet["decoded"]["portnum"]
         if "channel" in packet:
             channel = packet["channel"]
         else:
             channel = 0
 
+        interface_name = get_radio().name
         channel_mapped = False
         for room in matrix_rooms:
-            if room["meshtastic_channel"] == channel:
+            if (
+                room["meshtastic_channel"] == channel
+                and get_room_interface(room) == interface_name
+            ):
                 channel_mapped = True
                 break
 
         if not channel_mapped:
-            self.logger.debug(f"Skipping message from unmapped channel {channel}")
+            self.logger.debug("Skipping message from unmapped channel %s", channel)
             return
 
+        # Filter before serializing, high-frequency packets are the common case
+        if not self.should_forward(packet):
+            return False
+
+        packet = self.process(packet)
+        matrix_client = await connect_matrix()
+
+        packet_type = packet["decoded"]["portnum"]
+
         await matrix_client.room_send(
             room_id=room["id"],
             message_type="m.room.message",
@@ -95,13 +164,14 @@ class Plugin(BasePlugin):
         if not self.matches(full_message):
             return False
 
-        channel = None
-        for room in matrix_rooms:
-            if room["id"] == room["id"]:
-                channel = room["meshtastic_channel"]
+        room_config = None
+        for config in matrix_rooms:
+            if config["id"] == room.room_id:
+                room_config = config
+                break
 
-        if not channel:
-            self.logger.debug(f"Skipping message from unmapped channel {channel}")
+        if room_config is None:
+            self.logger.debug("Skipping message from unmapped room %s", room.room_id)
             return False
 
         packet_json = event.source["content"].get("meshtastic_packet")
@@ -115,19 +185,28 @@ class Plugin(BasePlugin):
             self.logger.error(f"Error processing embedded packet: {e}")
             return
 
-        from meshtastic_utils import connect_meshtastic
+        from meshtastic_utils import get_radio, get_room_interface
+
+        # The supervisor reconnects a radio that is down, never block on it here
+        radio = get_radio(get_room_interface(room_config))
+        meshtastic_client = radio.client
+        if meshtastic_client is None:
+            self.logger.debug("Radio %s is not connected, skipping packet", radio.name)
+            return False
 
-        meshtastic_client = connect_meshtastic()
         meshPacket = mesh_pb2.MeshPacket()
-        meshPacket.channel = channel
+        meshPacket.channel = room_config["meshtastic_channel"]
         meshPacket.decoded.payload = base64.b64decode(packet["decoded"]["payload"])
         meshPacket.decoded.portnum = packet["decoded"]["portnum"]
         meshPacket.decoded.want_response = False
         meshPacket.id = meshtastic_client._generatePacketId()
 
-        self.logger.debug(f"Relaying packet to Radio")
+        # Remember our own copy so it is not relayed again if it loops back
+        dedup_cache.seen(meshtastic_client.myInfo.my_node_num, meshPacket.id)
+
+        self.logger.debug("Relaying packet to Radio")
 
-        meshtastic_client._sendPacket(
+        await radio.transport.send_packet(
             meshPacket=meshPacket, destinationId=packet["toId"]
         )
         return True
@@ -34,13 +34,14 @@ $shortname $longname / $devicemodel / $battery $voltage / $snr / $lastseen
 """
 
     def generate_response(self):
-        from meshtastic_utils import connect_meshtastic
+        from meshtastic_utils import get_nodes
 
-        meshtastic_client = connect_meshtastic()
+        # Nodes whose NODEINFO has not been received have no names to show
+        nodes = {node: info for node, info in get_nodes().items() if "user" in info}
 
-        response = f">**Nodes: {len(meshtastic_client.nodes)}**\n\n"
+        response = f">**Nodes: {len(nodes)}**\n\n"
 
-        for node, info in meshtastic_client.nodes.items():
+        for node, info in nodes.items():
             snr = ""
             if "snr" in info and info['snr'] is not None:
                 snr = f"{info['snr']} dB "
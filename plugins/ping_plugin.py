@@ -24,10 +24,11 @@ class Plugin(BasePlugin):
             if f"!{self.plugin_name}" not in message:
                 return
 
-            from meshtastic_utils import connect_meshtastic
+            from meshtastic_utils import get_transport
 
-            meshtastic_client = connect_meshtastic()
-            meshtastic_client.sendText(text="pong!", destinationId=packet["fromId"])
+            await get_transport().send_text(
+                text="pong!", destinationId=packet["fromId"]
+            )
             return True
 
     def get_matrix_commands(self):
@@ -0,0 +1,38 @@
+import asyncio
+
+from plugins.base_plugin import BasePlugin
+
+
+class Plugin(BasePlugin):
+    plugin_name = "reload"
+
+    @property
+    def description(self):
+        return "Reload config.yaml and the plugins without reconnecting"
+
+    async def handle_meshtastic_message(
+        self, packet, formatted_message, longname, meshnet_name
+    ):
+        return False
+
+    def get_matrix_commands(self):
+        return [self.plugin_name]
+
+    def get_mesh_commands(self):
+        return []
+
+    async def handle_room_message(self, room, event, full_message):
+        full_message = full_message.strip()
+        if not self.matches(full_message):
+            return False
+
+        if event.sender not in self.config.get("admins", []):
+            self.logger.warning(f"Ignoring reload requested by {event.sender}")
+            return True
+
+        from reload_utils import reload_relay
+
+        # Shielded, so the reload completes even if this handler times out
+        reply = await asyncio.shield(asyncio.create_task(reload_relay()))
+        await self.send_matrix_message(room.room_id, reply)
+        return True
@@ -0,0 +1,43 @@
+from plugins.base_plugin import BasePlugin
+from plugin_loader import get_plugin_latency_stats
+
+
+class Plugin(BasePlugin):
+    plugin_name = "stats"
+
+    @property
+    def description(self):
+        return "Show plugin handler latency (p50 / p95 / p99 / max in ms)"
+
+    def generate_response(self):
+        stats = get_plugin_latency_stats()
+        if not stats:
+            return "No plugin handlers have run yet"
+
+        def ms(value):
+            return f"{value * 1000:.1f}" if value is not None else "-"
+
+        lines = []
+        for (plugin_name, handler), summary in sorted(stats.items()):
+            source = "mesh" if handler == "handle_meshtastic_message" else "matrix"
+            lines.append(
+                f"{plugin_name} ({source}): {summary['count']} calls, "
+                f"{ms(summary['p50'])} / {ms(summary['p95'])} / {ms(summary['p99'])} / {ms(summary['max'])} ms, "
+                f"{summary['slow']} slow"
+            )
+        return "\n".join(lines)
+
+    async def handle_meshtastic_message(
+        self, packet, formatted_message, longname, meshnet_name
+    ):
+        return False
+
+    async def handle_room_message(self, room, event, full_message):
+        full_message = full_message.strip()
+        if not self.matches(full_message):
+            return False
+
+        await self.send_matrix_message(
+            room.room_id, self.generate_response(), formatted=False
+        )
+        return True
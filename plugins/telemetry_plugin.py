@@ -1,35 +1,113 @@
-import json
 import io
 import re
+import time
 import matplotlib.pyplot as plt
+from matplotlib.ticker import MaxNLocator
 from PIL import Image
-from datetime import datetime, timedelta
+from datetime import datetime
 
 from plugins.base_plugin import BasePlugin
+from scheduler_utils import scheduler
+from db_utils import (
+    compact_telemetry,
+    get_telemetry_rollups,
+    record_telemetry_rollups,
+    telemetry_metrics,
+    telemetry_resolutions,
+)
 
 
 class Plugin(BasePlugin):
     plugin_name = "telemetry"
     max_data_rows_per_node = 50
+    metrics = list(telemetry_metrics)
+
+    # Rollup resolutions in seconds, and the default days each is kept for
+    resolutions = dict(telemetry_resolutions)
+    retention_days = {"raw": 1, "5m": 7, "hourly": 90, "daily": 1825}
+    graph_points = 12
+    window_units = {"m": 60, "h": 3600, "d": 86400, "w": 7 * 86400, "M": 30 * 86400}
+    default_window = 12 * 3600
 
     def commands(self):
         return ["batteryLevel", "voltage", "airUtilTx"]
 
     def description(self):
-        return f"Graph of avg Mesh telemetry value for last 12 hours"
+        return f"Graph of avg Mesh telemetry value, for the last 12 hours or a window like 1d, 2w or 1M"
+
+    def start(self):
+        super().start()
+        scheduler.add_job(
+            f"{self.plugin_name}_compaction", self.compact, hours=1, jitter=60
+        )
+
+    def stop(self):
+        super().stop()
+        scheduler.remove_job(f"{self.plugin_name}_compaction")
 
-    def _generate_timeperiods(self, hours=12):
-        # Calculate the start and end times
-        end_time = datetime.now()
-        start_time = end_time - timedelta(hours=hours)
+    def get_retention_days(self, name):
+        return self.config.get("retention_days", {}).get(
+            name, self.retention_days[name]
+        )
 
-        # Create a list of hourly intervals for the last 12 hours
-        hourly_intervals = []
-        current_time = start_time
-        while current_time <= end_time:
-            hourly_intervals.append(current_time)
-            current_time += timedelta(hours=1)
-        return hourly_intervals
+    def compact(self):
+        """Expire raw samples and rollups past their retention."""
+        compact_telemetry(
+            self.plugin_name,
+            self.get_retention_days("raw") * 86400,
+            {
+                resolution: self.get_retention_days(name) * 86400
+                for name, resolution in self.resolutions.items()
+            },
+            time.time(),
+        )
+
+    def parse_window(self, arg):
+        match = re.fullmatch(r"(\d+)([mhdwM])", arg)
+        if not match:
+            return None
+        return int(match.group(1)) * self.window_units[match.group(2)]
+
+    def get_averages(self, metric, window, node=None):
+        """
+        Average a metric over `graph_points` periods of the last `window` seconds.
+
+        The coarsest rollup no longer than a period is used, so long windows read
+        a few aggregate rows. Windows too short for the rollups use raw samples.
+
+        :return: The period length in seconds and a list of (start time, average).
+        """
+        end = time.time()
+        start = end - window
+        step = window / self.graph_points
+        resolutions = [
+            resolution for resolution in self.resolutions.values() if resolution <= step
+        ]
+
+        if resolutions:
+            resolution = max(resolutions)
+            rows = get_telemetry_rollups(resolution, metric, start, end, node)
+            averages = {bucket: total / count for bucket, count, total, _, _ in rows}
+            first_bucket = int(start // resolution) * resolution
+            return resolution, [
+                (datetime.fromtimestamp(bucket), averages.get(bucket, 0.0))
+                for bucket in range(first_bucket, int(end), resolution)
+            ]
+
+        values = [[] for _ in range(self.graph_points)]
+        node_rows = [self.get_node_data(node)] if node else self.get_nodes_data().values()
+        for rows in node_rows:
+            for record in rows:
+                index = int((record["time"] - start) // step)
+                if 0 <= index < self.graph_points:
+                    values[index].append(record[metric])
+        return step, [
+            (
+                datetime.fromtimestamp(start + i * step),
+                sum(period) / len(period) if period else 0.0,
+            )
+            for i, period in enumerate(values)
+        ]
 
     async def handle_meshtastic_message(
         self, packet, formatted_message, longname, meshnet_name
@@ -42,27 +120,28 @@ class Plugin(BasePlugin):
             and "telemetry" in packet["decoded"]
             and "deviceMetrics" in packet["decoded"]["telemetry"]
         ):
-            telemetry_data = []
-            data = self.get_node_data(meshtastic_id=packet["fromId"])
-            if data:
-                telemetry_data = data
             packet_data = packet["decoded"]["telemetry"]
-
-            telemetry_data.append(
-                {
-                    "time": packet_data["time"],
-                    "batteryLevel": packet_data["deviceMetrics"]["batteryLevel"]
-                    if "batteryLevel" in packet_data["deviceMetrics"]
-                    else 0,
-                    "voltage": packet_data["deviceMetrics"]["voltage"]
-                    if "voltage" in packet_data["deviceMetrics"]
-                    else 0,
-                    "airUtilTx": packet_data["deviceMetrics"]["airUtilTx"]
-                    if "airUtilTx" in packet_data["deviceMetrics"]
-                    else 0,
-                }
+            sample_time = packet_data.get("time") or int(time.time())
+
+            sample = {
+                "time": sample_time,
+                "batteryLevel": packet_data["deviceMetrics"]["batteryLevel"]
+                if "batteryLevel" in packet_data["deviceMetrics"]
+                else 0,
+                "voltage": packet_data["deviceMetrics"]["voltage"]
+                if "voltage" in packet_data["deviceMetrics"]
+                else 0,
+                "airUtilTx": packet_data["deviceMetrics"]["airUtilTx"]
+                if "airUtilTx" in packet_data["deviceMetrics"]
+                else 0,
+            }
+            self.append_node_data(packet["fromId"], sample)
+            record_telemetry_rollups(
+                packet["fromId"],
+                sample_time,
+                {metric: sample[metric] for metric in self.metrics},
+                list(self.resolutions.values()),
             )
-            self.set_node_data(meshtastic_id=packet["fromId"], node_data=telemetry_data)
             return False
 
     def get_matrix_commands(self):
@@ -92,67 +171,44 @@ class Plugin(BasePlugin):
             return False
 
         telemetry_option = match.group(1)
-        node = match.group(2)
+        node = None
+        window = self.default_window
+        window_arg = "12h"
+        for arg in (match.group(2) or "").split():
+            parsed_window = self.parse_window(arg)
+            if parsed_window:
+                window, window_arg = parsed_window, arg
+            else:
+                node = arg
 
-        hourly_intervals = self._generate_timeperiods()
         from matrix_utils import connect_matrix
 
         matrix_client = await connect_matrix()
 
-        # Compute the hourly averages for each node
-        hourly_averages = {}
-
-        def calculate_averages(node_data_rows):
-            for record in node_data_rows:
-                record_time = datetime.fromtimestamp(
-                    record["time"]
-                )  # Replace with your timestamp field name
-                telemetry_value = record[
-                    telemetry_option
-                ]  # Replace with your battery level field name
-                for i in range(len(hourly_intervals) - 1):
-                    if hourly_intervals[i] <= record_time < hourly_intervals[i + 1]:
-                        if i not in hourly_averages:
-                            hourly_averages[i] = []
-                        hourly_averages[i].append(telemetry_value)
-                        break
+        step, averages = self.get_averages(telemetry_option, window, node)
 
-        if node:
-            node_data_rows = self.get_node_data(node)
-            calculate_averages(node_data_rows)
+        # Label the periods by day for daily periods and by time otherwise
+        if step >= 86400:
+            label_format = "%m-%d"
+        elif step >= 3600 and window <= 86400:
+            label_format = "%H"
         else:
-            for node_data_json in self.get_data():
-                node_data_rows = json.loads(node_data_json[0])
-                calculate_averages(node_data_rows)
-
-        # Compute the final hourly averages
-        final_averages = {}
-        for i, interval in enumerate(hourly_intervals[:-1]):
-            if i in hourly_averages:
-                final_averages[interval] = sum(hourly_averages[i]) / len(
-                    hourly_averages[i]
-                )
-            else:
-                final_averages[interval] = 0.0
-
-        # Extract the hourly intervals and average values into separate lists
-        hourly_intervals = list(final_averages.keys())
-        average_values = list(final_averages.values())
-
-        # Convert the hourly intervals to strings
-        hourly_strings = [hour.strftime("%H") for hour in hourly_intervals]
+            label_format = "%m-%d %H:%M" if window > 86400 else "%H:%M"
+        period_strings = [period.strftime(label_format) for period, _ in averages]
+        average_values = [average for _, average in averages]
 
         # Create the plot
         fig, ax = plt.subplots()
-        ax.plot(hourly_strings, average_values)
+        ax.plot(period_strings, average_values)
+        ax.xaxis.set_major_locator(MaxNLocator(self.graph_points))
 
         # Set the plot title and axis labels
         if node:
-            title = f"{node} Hourly {telemetry_option} Averages"
+            title = f"{node} {telemetry_option} Averages ({window_arg})"
         else:
-            title = f"Network Hourly {telemetry_option} Averages"
+            title = f"Network {telemetry_option} Averages ({window_arg})"
         ax.set_title(title)
-        ax.set_xlabel("Hour")
+        ax.set_xlabel("Time")
         ax.set_ylabel(f"{telemetry_option}")
 
         # Rotate the x-axis labels for readability
@@ -1,3 +1,4 @@
+import asyncio
 import time
 import io
 import os
@@ -109,7 +110,10 @@ class Plugin(BasePlugin):
 
         try:
             self.logger.debug(f"Fetching image from URL: {url} with headers: {headers}")
-            response = requests.get(url, headers=headers)
+            # The request is blocking, keep it off the event loop
+            response = await asyncio.get_running_loop().run_in_executor(
+                None, lambda: requests.get(url, headers=headers, timeout=20)
+            )
             response.raise_for_status()
             self.logger.info("Image successfully fetched from Grafana")
         except requests.exceptions.RequestException as e:
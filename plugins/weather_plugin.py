@@ -1,3 +1,4 @@
+import asyncio
 import re
 import requests
 
@@ -15,7 +16,7 @@ class Plugin(BasePlugin):
         url = f"https://api.open-meteo.com/v1/forecast?latitude={latitude}&longitude={longitude}&hourly=temperature_2m,precipitation_probability,weathercode,cloudcover&forecast_days=1&current_weather=true"
 
         try:
-            response = requests.get(url)
+            response = requests.get(url, timeout=20)
             data = response.json()
 
             # Extract relevant weather data
@@ -82,24 +83,27 @@ class Plugin(BasePlugin):
             if f"!{self.plugin_name}" not in message:
                 return False
 
-            from meshtastic_utils import connect_meshtastic
+            from meshtastic_utils import get_nodes, get_transport
 
-            meshtastic_client = connect_meshtastic()
-            if packet["fromId"] in meshtastic_client.nodes:
+            nodes = get_nodes()
+            if packet["fromId"] in nodes:
                 weather_notice = "Cannot determine location"
-                requesting_node = meshtastic_client.nodes.get(packet["fromId"])
+                requesting_node = nodes.get(packet["fromId"])
                 if (
                     requesting_node
                     and "position" in requesting_node
                     and "latitude" in requesting_node["position"]
                     and "longitude" in requesting_node["position"]
                 ):
-                    weather_notice = self.generate_forecast(
-                        latitude=requesting_node["position"]["latitude"],
-                        longitude=requesting_node["position"]["longitude"],
+                    # The forecast request is blocking, keep it off the event loop
+                    weather_notice = await asyncio.get_running_loop().run_in_executor(
+                        None,
+                        self.generate_forecast,
+                        requesting_node["position"]["latitude"],
+                        requesting_node["position"]["longitude"],
                     )
 
-                meshtastic_client.sendText(
+                await get_transport().send_text(
                     text=weather_notice,
                     destinationId=packet["fromId"],
                 )
@@ -0,0 +1,59 @@
+import asyncio
+import time
+from config import relay_config, reload_config
+from log_utils import get_logger
+from matrix_utils import connect_matrix, join_matrix_room, update_sync_filter
+from meshtastic_utils import update_radio_configs
+from plugin_loader import load_plugins, unload_plugins
+
+logger = get_logger(name="Reload")
+
+reloading = False
+
+
+def get_room_ids():
+    return {room["id"] for room in relay_config["matrix_rooms"]}
+
+
+async def reload_relay():
+    """
+    Reload config.yaml and the plugins while the radio and Matrix connections stay up.
+
+    Plugins are stopped and started again from the new config and source, with
+    their schedules. Newly mapped rooms are joined and the sync filter replaced.
+    Matrix credentials, logging, metrics and database settings need a restart.
+
+    :return: A short description of the outcome.
+    """
+    global reloading
+    if reloading:
+        return "A reload is already in progress"
+
+    reloading = True
+    start_time = time.perf_counter()
+    try:
+        old_room_ids = get_room_ids()
+        try:
+            reload_config()
+        except Exception as e:
+            logger.error(f"Error reading config.yaml, keeping the current config: {e}")
+            return f"Reload failed, config.yaml could not be read: {e}"
+
+        update_radio_configs()
+
+        # Swap the plugins without yielding, so no message sees a half loaded set
+        unload_plugins()
+        plugins = load_plugins(reload_modules=True)
+
+        matrix_client = await connect_matrix()
+        await asyncio.gather(
+            *[join_matrix_room(matrix_client, room["id"]) for room in relay_config["matrix_rooms"]]
+        )
+        if get_room_ids() != old_room_ids:
+            update_sync_filter()
+
+        message = f"Reloaded config and {len(plugins)} plugins in {time.perf_counter() - start_time:.2f}s"
+        logger.info(message)
+        return message
+    finally:
+        reloading = False
@@ -0,0 +1,197 @@
+import asyncio
+import random
+import re
+import time
+from datetime import datetime, timedelta
+from log_utils import get_logger
+
+logger = get_logger(name="Scheduler")
+
+# Formats of `at` by job unit, as accepted by the `schedule` package
+at_formats = {
+    "minutes": (re.compile(r"^:\d{2}$"), '":SS"'),
+    "hours": (re.compile(r"^(\d{2})?:\d{2}$"), '"MM:SS" or ":MM"'),
+    "days": (re.compile(r"^\d{1,2}:\d{2}(:\d{2})?$"), '"HH:MM" or "HH:MM:SS"'),
+}
+
+
+class ScheduledJob:
+    def __init__(self, name, func, interval, at=None, unit=None, jitter=0):
+        self.name = name
+        self.func = func
+        self.interval = interval
+        self.at = at
+        self.unit = unit
+        self.jitter = jitter
+        self.due = None
+        self.next_run = None
+        self.running = False
+        self.run_count = 0
+        self.overlap_count = 0
+        self.error_count = 0
+        self.last_run = None
+        self.last_duration = None
+        self.max_duration = 0.0
+        self.total_duration = 0.0
+
+    def _first_aligned_run(self, now):
+        """
+        Align the first run to `at`, following the `schedule` package conventions:
+        ":MM" or "MM:SS" for hourly jobs, ":SS" for minute jobs and "HH:MM" or
+        "HH:MM:SS" for daily jobs.
+        """
+        current = datetime.fromtimestamp(now)
+        fields = self.at.split(":")
+
+        if self.unit == "minutes":
+            candidate = current.replace(second=int(fields[1]), microsecond=0)
+            step = timedelta(minutes=1)
+        elif self.unit == "hours" and not fields[0]:
+            candidate = current.replace(minute=int(fields[1]), second=0, microsecond=0)
+            step = timedelta(hours=1)
+        elif self.unit == "hours":
+            candidate = current.replace(
+                minute=int(fields[0]), second=int(fields[1]), microsecond=0
+            )
+            step = timedelta(hours=1)
+        else:
+            candidate = current.replace(
+                hour=int(fields[0]),
+                minute=int(fields[1]),
+                second=int(fields[2]) if len(fields) > 2 else 0,
+                microsecond=0,
+            )
+            step = timedelta(days=1)
+
+        while candidate.timestamp() <= now:
+            candidate += step
+        return candidate.timestamp()
+
+    def schedule_next(self, now):
+        if self.due is None and self.at:
+            self.due = self._first_aligned_run(now)
+        elif self.due is None:
+            self.due = now + self.interval
+        else:
+            # Keep the cadence fixed rather than drifting by the job duration
+            while self.due <= now:
+                self.due += self.interval
+        self.next_run = self.due + (random.uniform(0, self.jitter) if self.jitter else 0)
+
+    def stats(self):
+        return {
+            "name": self.name,
+            "runs": self.run_count,
+            "errors": self.error_count,
+            "overlaps": self.overlap_count,
+            "last_run": self.last_run,
+            "last_duration": self.last_duration,
+            "avg_duration": self.total_duration / self.run_count
+            if self.run_count
+            else None,
+            "max_duration": self.max_duration,
+            "next_run": self.next_run,
+        }
+
+
+class RelayScheduler:
+    """
+    A single asyncio scheduler shared by all plugins.
+
+    Coroutine jobs run on the event loop, plain functions are offloaded to the
+    default executor. A job is never started while its previous run is still going.
+    """
+
+    def __init__(self):
+        self.jobs = {}
+        self._task = None
+        self._wakeup = None
+        self._running_tasks = set()
+
+    def add_job(self, name, func, hours=None, minutes=None, at=None, jitter=0):
+        if minutes:
+            interval, unit = minutes * 60, "minutes"
+        elif hours:
+            interval, unit = hours * 3600, "hours"
+        elif at:
+            interval, unit = 86400, "days"
+        else:
+            raise ValueError(f"Job {name} needs hours, minutes or at")
+
+        if at:
+            pattern, expected = at_formats[unit]
+            if not pattern.match(at):
+                raise ValueError(
+                    f"Job {name} has an invalid at {at!r}, {unit} jobs take {expected}"
+                )
+
+        job = ScheduledJob(name, func, interval, at=at, unit=unit, jitter=jitter)
+        job.schedule_next(time.time())
+        self.jobs[name] = job
+        if self._wakeup:
+            self._wakeup.set()
+        return job
+
+    def remove_job(self, name):
+        self.jobs.pop(name, None)
+
+    def get_job_stats(self):
+        return [job.stats() for job in self.jobs.values()]
+
+    def start(self):
+        if self._task is None:
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    def stop(self):
+        if self._task:
+            self._task.cancel()
+            self._task = None
+
+    async def _run(self):
+        while True:
+            now = time.time()
+            for job in list(self.jobs.values()):
+                if job.next_run <= now:
+                    job.schedule_next(now)
+                    if job.running:
+                        job.overlap_count += 1
+                        logger.warning(
+                            f"Skipping {job.name}, previous run is still in progress"
+                        )
+                        continue
+                    job.running = True
+                    task = asyncio.create_task(self._execute(job))
+                    self._running_tasks.add(task)
+                    task.add_done_callback(self._running_tasks.discard)
+
+            next_run = min((job.next_run for job in self.jobs.values()), default=None)
+            delay = max(next_run - time.time(), 0) if next_run else 3600
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=delay)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _execute(self, job):
+        job.last_run = time.time()
+        start_time = time.monotonic()
+        try:
+            if asyncio.iscoroutinefunction(job.func):
+                await job.func()
+            else:
+                await asyncio.get_running_loop().run_in_executor(None, job.func)
+        except Exception as e:
+            job.error_count += 1
+            logger.error(f"Error running scheduled job {job.name}: {e}")
+        finally:
+            duration = time.monotonic() - start_time
+            job.running = False
+            job.run_count += 1
+            job.last_duration = duration
+            job.total_duration += duration
+            job.max_duration = max(job.max_duration, duration)
+            logger.debug(f"Ran {job.name} in {duration:.3f}s")
+
+
+scheduler = RelayScheduler()
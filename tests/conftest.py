@@ -0,0 +1,12 @@
+import os
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# The relay modules read config.yaml from the working directory on import
+config_dir = tempfile.mkdtemp(prefix="mmrelay-test-")
+with open(os.path.join(config_dir, "config.yaml"), "w") as f:
+    f.write('logging:\n  level: "warning"\n')
+os.chdir(config_dir)
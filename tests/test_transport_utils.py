@@ -0,0 +1,84 @@
+import asyncio
+
+from transport_utils import MeshtasticTransport
+
+
+class FakeInterface:
+    """Dispatches responses the way meshtastic's MeshInterface does."""
+
+    def __init__(self):
+        self.packet_id = 0
+        self.response_handlers = {}
+
+    def sendText(
+        self,
+        text,
+        destinationId="^all",
+        wantAck=False,
+        wantResponse=False,
+        onResponse=None,
+        channelIndex=0,
+        onResponseAckPermitted=False,
+    ):
+        self.packet_id += 1
+        if onResponse:
+            self.response_handlers[self.packet_id] = (onResponse, onResponseAckPermitted)
+        return {"id": self.packet_id, "decoded": {"text": text}}
+
+    def receive(self, packet):
+        # See MeshInterface._handlePacketFromRadio
+        decoded = packet["decoded"]
+        handler = self.response_handlers.get(decoded.get("requestId"))
+        if handler is None:
+            return
+        callback, ack_permitted = handler
+        routing = decoded.get("routing")
+        is_ack = routing is not None and routing.get("errorReason", "NONE") == "NONE"
+        if not is_ack or callback.__name__ == "onAckNak" or ack_permitted:
+            del self.response_handlers[decoded["requestId"]]
+            callback(packet)
+
+
+def routing_packet(request_id, error_reason="NONE"):
+    return {
+        "decoded": {
+            "portnum": "ROUTING_APP",
+            "requestId": request_id,
+            "routing": {"errorReason": error_reason},
+        }
+    }
+
+
+async def send_and_respond(error_reason):
+    interface = FakeInterface()
+    transport = MeshtasticTransport(lambda: interface, name="test")
+    send = asyncio.ensure_future(
+        transport.send_text("hello", wait_for_ack=True, ack_timeout=5)
+    )
+    while not interface.response_handlers:
+        await asyncio.sleep(0.01)
+    # Responses arrive on the meshtastic reader thread
+    await asyncio.get_running_loop().run_in_executor(
+        None, interface.receive, routing_packet(interface.packet_id, error_reason)
+    )
+    try:
+        return await send
+    finally:
+        transport.close()
+
+
+def test_send_text_resolves_on_ack():
+    assert asyncio.run(send_and_respond("NONE")) is True
+
+
+def test_send_text_resolves_on_nak():
+    assert asyncio.run(send_and_respond("MAX_RETRANSMIT")) is False
+
+
+def test_send_text_without_ack():
+    interface = FakeInterface()
+    transport = MeshtasticTransport(lambda: interface, name="test")
+    packet = asyncio.run(transport.send_text("hello"))
+    transport.close()
+    assert packet["decoded"]["text"] == "hello"
+    assert not interface.response_handlers
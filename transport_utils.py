@@ -0,0 +1,119 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from log_utils import get_logger
+
+logger = get_logger(name="Transport")
+
+BROADCAST_ADDR = "^all"
+
+
+class MeshtasticTransport:
+    """
+    Asyncio facade around a blocking meshtastic interface.
+
+    Every call runs on one dedicated I/O thread, so sends are serialized in the
+    order they were queued and coroutines never block the event loop.
+    """
+
+    def __init__(self, interface_provider, name="meshtastic"):
+        self._get_interface = interface_provider
+        self.name = name
+        self._executor = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix=f"{name}-io"
+        )
+
+    @property
+    def interface(self):
+        interface = self._get_interface()
+        if interface is None:
+            raise ConnectionError(f"Radio {self.name} is not connected")
+        return interface
+
+    def queue_depth(self):
+        return self._executor._work_queue.qsize()
+
+    async def call(self, method, *args, **kwargs):
+        """
+        Run a method of the interface on the I/O thread.
+
+        :param method: The name of the interface method, e.g. `getMyNodeInfo`.
+        :return: The value returned by the method.
+        """
+        interface = self.interface
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self._executor, lambda: getattr(interface, method)(*args, **kwargs)
+        )
+
+    async def send_admin(self, message, on_response=None):
+        """
+        Send an admin message to the local node without waiting for the reply.
+
+        :param on_response: Called from the meshtastic thread with the response packet.
+        """
+        interface = self.interface
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self._executor,
+            lambda: interface.localNode._sendAdmin(
+                message, wantResponse=True, onResponse=on_response
+            ),
+        )
+
+    async def get_my_node_info(self):
+        return await self.call("getMyNodeInfo")
+
+    async def send_packet(self, meshPacket, destinationId=BROADCAST_ADDR):
+        return await self.call(
+            "_sendPacket", meshPacket=meshPacket, destinationId=destinationId
+        )
+
+    async def send_text(
+        self,
+        text,
+        destinationId=BROADCAST_ADDR,
+        channelIndex=0,
+        wait_for_ack=False,
+        ack_timeout=30,
+    ):
+        """
+        Queue a text message for the radio and wait until it has been sent.
+
+        :param wait_for_ack: Also wait for the ACK/NAK of the message.
+        :param ack_timeout: Seconds to wait for the ACK before raising `asyncio.TimeoutError`.
+        :return: The sent packet, or True/False for ACK/NAK if `wait_for_ack` is set.
+        """
+        if not wait_for_ack:
+            return await self.call(
+                "sendText",
+                text=text,
+                destinationId=destinationId,
+                channelIndex=channelIndex,
+            )
+
+        loop = asyncio.get_running_loop()
+        response = loop.create_future()
+
+        # Invoked on the meshtastic reader thread. meshtastic only passes ACKs, as
+        # opposed to NAKs and replies, to a response handler named onAckNak.
+        def onAckNak(packet):
+            def resolve():
+                if not response.done():
+                    response.set_result(packet)
+
+            loop.call_soon_threadsafe(resolve)
+
+        await self.call(
+            "sendText",
+            text=text,
+            destinationId=destinationId,
+            channelIndex=channelIndex,
+            wantAck=True,
+            onResponse=onAckNak,
+        )
+        packet = await asyncio.wait_for(response, timeout=ack_timeout)
+        routing = packet.get("decoded", {}).get("routing", {})
+        return routing.get("errorReason", "NONE") == "NONE"
+
+    def close(self):
+        self._executor.shutdown(wait=False)